@@ -12,4 +12,5 @@ admin.site.register(models.Cart)
 admin.site.register(models.CartItems)
 admin.site.register(models.Order)
 admin.site.register(models.OrderItem)
-admin.site.register(models.Payment)
\ No newline at end of file
+admin.site.register(models.Payment)
+admin.site.register(models.WebhookEvent)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import gzip
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils import timezone
+from .carts import dirty_cart_ids
+from .history import ORDER_LINES
+from .models import ArchivedOrder, Cart, CartItems, Order, Payment
+from .serializers import OrderSerializer
+
+
+ARCHIVE_ROOT = getattr(settings, 'ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'archive'))
+
+# delivered and cancelled orders untouched for this long leave the hot tables
+ORDER_ARCHIVE_DAYS = getattr(settings, 'ORDER_ARCHIVE_DAYS', 365)
+
+# carts no order points to, untouched for this long
+CART_ARCHIVE_DAYS = getattr(settings, 'CART_ARCHIVE_DAYS', 180)
+
+ARCHIVED_STATUSES = (Order.DELIVERED, Order.CANCELLED)
+
+
+def archivable_orders(days=ORDER_ARCHIVE_DAYS):
+    # payments still waiting for the sales roll-ups need their order lines
+    pending_rollup = Payment.objects.filter(order=OuterRef('pk'), rollup_batch__isnull=True)
+    return Order.objects.filter(
+        status__in=ARCHIVED_STATUSES, updated_at__lt=timezone.now() - timedelta(days=days),
+    ).exclude(Exists(pending_rollup))
+
+
+def archived_order(order):
+    # expects the order lines prefetched with ORDER_LINES and the payments
+    return ArchivedOrder(
+        id=order.pk, user_id=order.user_id, status=order.status, date_created=order.date_created,
+        updated_at=order.updated_at, document=OrderSerializer(order).data,
+        details={
+            'cart_id': order.cart_id,
+            'delivery_crew_id': order.delivery_crew_id,
+            'postcode': order.postcode,
+            'payments': [payment.pk for payment in order.payments.all()],
+        })
+
+
+def archive_orders(days=ORDER_ARCHIVE_DAYS, batch_size=500):
+    """
+    Move archivable orders into ArchivedOrder, oldest id first, one
+    transaction per batch: the archive rows are written and the orders
+    deleted together, with their lines, history and reservations. Payments
+    stay, pointing at no order. Stopping at any point loses nothing and the
+    next run carries on. Returns how many orders were archived.
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            orders = list(archivable_orders(days).order_by('pk').prefetch_related(
+                ORDER_LINES, Prefetch('payments', queryset=Payment.objects.only('pk', 'order_id')))[:batch_size])
+            if not orders:
+                return archived
+            ArchivedOrder.objects.bulk_create([archived_order(order) for order in orders], ignore_conflicts=True)
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+        archived += len(orders)
+
+
+def dead_carts(days=CART_ARCHIVE_DAYS):
+    # carts with Redis writes not flushed yet are live whatever updated_at says
+    return Cart.objects.filter(updated_at__lt=timezone.now() - timedelta(days=days)).exclude(
+        Exists(Order.objects.filter(cart=OuterRef('pk')))).exclude(pk__in=dirty_cart_ids())
+
+
+def cart_archive_path(first_cart_id):
+    return os.path.join(ARCHIVE_ROOT, 'carts', f'carts-{first_cart_id}.jsonl.gz')
+
+
+def archive_carts(days=CART_ARCHIVE_DAYS, batch_size=1000):
+    """
+    Write dead carts and their items to gzipped JSONL files under
+    ARCHIVE_ROOT, a file per batch, and delete them. The file is complete
+    on disk before the carts are deleted, so a batch cut short is written
+    again under the same name by the next run. Returns how many carts were
+    archived.
+    """
+    os.makedirs(os.path.join(ARCHIVE_ROOT, 'carts'), exist_ok=True)
+    archived = 0
+    while True:
+        carts = list(dead_carts(days).order_by('pk').values(
+            'id', 'user_id', 'created_at', 'updated_at', 'completed')[:batch_size])
+        if not carts:
+            return archived
+        cart_ids = [cart['id'] for cart in carts]
+        items = {}
+        for cart_id, product_id, quantity in (CartItems.objects.filter(cart_id__in=cart_ids)
+                                              .values_list('cart_id', 'product_id', 'quantity')):
+            items.setdefault(cart_id, []).append({'product_id': product_id, 'quantity': quantity})
+
+        path = cart_archive_path(cart_ids[0])
+        encoder = DjangoJSONEncoder()
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+            for cart in carts:
+                archive.write(encoder.encode({**cart, 'items': items.get(cart['id'], [])}) + '\n')
+        os.replace(path + '.tmp', path)
+
+        with transaction.atomic():
+            # a cart that got an order in the meantime stays
+            _, deleted = dead_carts(days).filter(pk__in=cart_ids).delete()
+        archived += deleted.get(Cart._meta.label, 0)
@@ -0,0 +1,114 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+
+CATALOG_CACHE_SECONDS = getattr(settings, 'CATALOG_CACHE_SECONDS', 60 * 60 * 24)
+
+
+def generation_key(name):
+    return f'catalog:generation:{name}'
+
+
+def get_generations(names):
+    """
+    Return the current generation of every name, in one cache round trip.
+    Names that have never been bumped start at generation 1.
+    """
+    keys = [generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    return [found.get(key, 1) for key in keys]
+
+
+def bump_generation(*names):
+    """
+    Move each name to a new generation so every cache entry built on the old
+    one is never read again and simply expires.
+    """
+    for name in names:
+        key = generation_key(name)
+        # generation keys never expire, otherwise a bump could reset to 1
+        cache.add(key, 1, timeout=None)
+        cache.incr(key)
+
+
+def increment_counter(key):
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key)
+
+
+def not_modified_metric_key(name):
+    return f'metrics:not_modified:{name}'
+
+
+def conditional_response(request, name, etag=None, last_modified=None):
+    """
+    Return a 304 response when the client's If-None-Match or
+    If-Modified-Since still matches, counting it under `name`, else None.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        increment_counter(not_modified_metric_key(name))
+        if etag:
+            response['ETag'] = etag
+    return response
+
+
+def catalog_cache_key(namespace, url, generations):
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
+    version = '.'.join(str(generation) for generation in generations)
+    return f'catalog:{namespace}:{version}:{digest}'
+
+
+class CatalogCacheMixin:
+    """
+    Cache list and retrieve responses under keys that embed the generations
+    the response depends on. Writes bump those generations through the
+    signals in api/signals.py, so a stale response is never served and only
+    the affected pages are rebuilt.
+
+    The same key doubles as a strong ETag, so a matching If-None-Match is
+    answered with a 304 before the cache or the database is touched.
+    """
+    catalog_namespace = None
+    catalog_dependencies = ()
+
+    def get_catalog_generations(self):
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is None:
+            names = [self.catalog_namespace]
+        else:
+            names = [f'{self.catalog_namespace}:{lookup}']
+        return names + list(self.catalog_dependencies)
+
+    def cached_response(self, request, build):
+        generations = get_generations(self.get_catalog_generations())
+        key = catalog_cache_key(
+            self.catalog_namespace, request.build_absolute_uri(), generations)
+        etag = f'"{hashlib.md5(key.encode("utf-8")).hexdigest()}"'
+
+        not_modified = conditional_response(request, self.catalog_namespace, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+        else:
+            response = build()
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, CATALOG_CACHE_SECONDS)
+
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,322 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .cache import CATALOG_CACHE_SECONDS, get_generations
+from .models import Cart, CartItems, Product
+from .serializers import SimpleProductSerializer
+
+
+# 'database' keeps carts in Cart/CartItems only, 'redis' serves live carts
+# from Redis hashes and writes them back with the flush_carts command
+CART_STORE = getattr(settings, 'CART_STORE', 'database')
+
+# live carts are flushed within a minute, this only evicts abandoned ones
+CART_TTL_SECONDS = 60 * 60 * 24 * 7
+
+DIRTY_CARTS_KEY = 'carts:dirty'
+
+# marks a hash as loaded, so an empty cart is not reloaded from the database
+LOADED_FIELD = 'loaded'
+
+DECREMENT_SCRIPT = """
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if quantity <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return quantity
+"""
+
+# takes back what a checkout flushed: the quantities are subtracted rather
+# than the hash deleted, so lines added since the flush stay and the cart
+# is marked dirty again for them
+FORGET_FLUSHED_SCRIPT = """
+for i = 3, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+local fields = redis.call('HLEN', KEYS[1])
+if fields == 0 or (fields == 1 and redis.call('HEXISTS', KEYS[1], ARGV[2]) == 1) then
+    redis.call('DEL', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[1])
+    return 0
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return fields
+"""
+
+
+def redis_carts_enabled():
+    return CART_STORE == 'redis'
+
+
+def product_summary_key(product_id, generations):
+    return f'carts:product:{product_id}:' + '.'.join(str(generation) for generation in generations)
+
+
+def product_summaries(product_ids):
+    """
+    Return {product_id: SimpleProductSerializer data} for the products that
+    exist, cached until the product or the catalog changes.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return {}
+    names = ['catalog'] + [f'products:{product_id}' for product_id in product_ids]
+    catalog, *own = get_generations(names)
+    keys = {product_id: product_summary_key(product_id, [catalog, generation])
+            for product_id, generation in zip(product_ids, own)}
+
+    found = cache.get_many(list(keys.values()))
+    summaries = {product_id: found[key] for product_id, key in keys.items() if key in found}
+    missing = [product_id for product_id in product_ids if product_id not in summaries]
+    if missing:
+        products = Product.objects.filter(pk__in=missing).only(*SimpleProductSerializer.Meta.fields)
+        fresh = {product.pk: SimpleProductSerializer(product).data for product in products}
+        cache.set_many({keys[product_id]: data for product_id, data in fresh.items()}, CATALOG_CACHE_SECONDS)
+        summaries.update(fresh)
+    return summaries
+
+
+def touch_cart(cart_id):
+    # item writes never save the Cart row itself
+    Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+
+def dirty_cart_ids():
+    # carts with Redis writes the database has not seen yet
+    if not redis_carts_enabled():
+        return []
+    return [cart_id.decode() for cart_id in cart_store().redis.smembers(DIRTY_CARTS_KEY)]
+
+
+def add_to_cart(cart_id, lines):
+    """
+    Add {product_id: quantity} to a cart in the database, returning
+    ({product_id: CartItems}, missing product ids). Nothing is written if
+    any product is missing.
+
+    Missing lines are inserted at quantity 0 by one bulk_create that skips
+    the lines already there, then one F() increment per distinct quantity
+    adds the amounts, so concurrent adds never lose an increment.
+    """
+    existing = set(Product.objects.filter(pk__in=list(lines)).values_list('id', flat=True))
+    missing = sorted(set(lines) - existing)
+    if missing or not lines:
+        return {}, missing
+
+    by_quantity = defaultdict(list)
+    for product_id, quantity in lines.items():
+        by_quantity[quantity].append(product_id)
+    with transaction.atomic():
+        CartItems.objects.bulk_create(
+            [CartItems(cart_id=cart_id, product_id=product_id, quantity=0) for product_id in lines],
+            ignore_conflicts=True)
+        for quantity, product_ids in by_quantity.items():
+            CartItems.objects.filter(cart_id=cart_id, product_id__in=product_ids).update(
+                quantity=F('quantity') + quantity)
+        touch_cart(cart_id)
+        items = {item.product_id: item for item in
+                 CartItems.objects.filter(cart_id=cart_id, product_id__in=list(lines))}
+    return items, []
+
+
+class RedisCartStore:
+    """
+    Live carts as Redis hashes of product id -> quantity. Every write also
+    adds the cart to a dirty set, which flush_carts and checkout drain into
+    Cart/CartItems.
+
+    Item ids in this store are product ids, there is no CartItems row to
+    take an id from until the cart is flushed.
+    """
+
+    def __init__(self, connection=None):
+        if connection is None:
+            from django_redis import get_redis_connection
+            connection = get_redis_connection('default')
+        self.redis = connection
+        self.decrement_script = self.redis.register_script(DECREMENT_SCRIPT)
+        self.forget_flushed_script = self.redis.register_script(FORGET_FLUSHED_SCRIPT)
+
+    def key(self, cart_id):
+        return f'carts:{cart_id}:items'
+
+    def items(self, cart_id):
+        """
+        Return {product_id: quantity}, loading the cart from the database the
+        first time it is touched. None if the cart does not exist.
+        """
+        stored = self.redis.hgetall(self.key(cart_id))
+        if not stored:
+            return self.load(cart_id)
+        return {int(field): int(quantity) for field, quantity in stored.items()
+                if field != LOADED_FIELD.encode()}
+
+    def load(self, cart_id):
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return None
+        items = {}
+        for product_id, quantity in CartItems.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'):
+            items[product_id] = items.get(product_id, 0) + quantity
+        key = self.key(cart_id)
+        pipeline = self.redis.pipeline()
+        pipeline.hsetnx(key, LOADED_FIELD, 1)
+        for product_id, quantity in items.items():
+            pipeline.hsetnx(key, product_id, quantity)
+        pipeline.expire(key, CART_TTL_SECONDS)
+        pipeline.execute()
+        return items
+
+    def exists(self, cart_id):
+        return self.redis.exists(self.key(cart_id)) or self.load(cart_id) is not None
+
+    def write(self, cart_id, command, *args):
+        key = self.key(cart_id)
+        pipeline = self.redis.pipeline()
+        getattr(pipeline, command)(key, *args)
+        pipeline.expire(key, CART_TTL_SECONDS)
+        pipeline.sadd(DIRTY_CARTS_KEY, str(cart_id))
+        return pipeline.execute()[0]
+
+    def add(self, cart_id, product_id, quantity):
+        return self.write(cart_id, 'hincrby', product_id, quantity)
+
+    def add_many(self, cart_id, lines):
+        key = self.key(cart_id)
+        pipeline = self.redis.pipeline()
+        for product_id, quantity in lines.items():
+            pipeline.hincrby(key, product_id, quantity)
+        pipeline.expire(key, CART_TTL_SECONDS)
+        pipeline.sadd(DIRTY_CARTS_KEY, str(cart_id))
+        return dict(zip(lines, pipeline.execute()))
+
+    def set(self, cart_id, product_id, quantity):
+        if quantity <= 0:
+            return self.write(cart_id, 'hdel', product_id)
+        return self.write(cart_id, 'hset', product_id, quantity)
+
+    def remove_one(self, cart_id, product_id):
+        quantity = self.decrement_script(keys=[self.key(cart_id)], args=[product_id])
+        self.redis.sadd(DIRTY_CARTS_KEY, str(cart_id))
+        return quantity
+
+    def flush(self, cart_id):
+        """
+        Replace the cart's CartItems with what Redis holds, returning the
+        {product_id: quantity} written, or None if there was nothing to
+        write. A write landing during the flush marks the cart dirty again,
+        so it is picked up by the next one.
+        """
+        self.redis.srem(DIRTY_CARTS_KEY, str(cart_id))
+        stored = self.redis.hgetall(self.key(cart_id))
+        if not stored:
+            return None
+        items = {int(field): int(quantity) for field, quantity in stored.items()
+                 if field != LOADED_FIELD.encode()}
+        existing = set(Product.objects.filter(pk__in=list(items)).values_list('id', flat=True))
+        with transaction.atomic():
+            if not Cart.objects.filter(pk=cart_id).exists():
+                self.forget(cart_id)
+                return None
+            CartItems.objects.filter(cart_id=cart_id).delete()
+            CartItems.objects.bulk_create([
+                CartItems(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                for product_id, quantity in items.items() if product_id in existing and quantity > 0
+            ])
+            touch_cart(cart_id)
+        return items
+
+    def flush_dirty(self, batch_size=500):
+        """
+        Flush every dirty cart, a batch at a time, returning how many.
+        """
+        flushed = 0
+        while True:
+            cart_ids = self.redis.spop(DIRTY_CARTS_KEY, batch_size)
+            if not cart_ids:
+                return flushed
+            for cart_id in cart_ids:
+                self.flush(cart_id.decode())
+            flushed += len(cart_ids)
+
+    def forget(self, cart_id):
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self.key(cart_id))
+        pipeline.srem(DIRTY_CARTS_KEY, str(cart_id))
+        pipeline.execute()
+
+    def forget_flushed(self, cart_id, items):
+        """
+        Take the lines of a flush back out of the cart once checkout has
+        consumed them. Returns how many fields the hash kept.
+        """
+        args = [str(cart_id), LOADED_FIELD]
+        for product_id, quantity in items.items():
+            args += [product_id, quantity]
+        return self.forget_flushed_script(keys=[self.key(cart_id), DIRTY_CARTS_KEY], args=args)
+
+
+_store = None
+
+
+def cart_store():
+    global _store
+    if _store is None:
+        _store = RedisCartStore()
+    return _store
+
+
+def flush_user_carts(user_id):
+    """
+    Write the user's live carts to the database before checkout reads them,
+    returning {cart_id: the lines written} for forget_carts.
+    """
+    if not redis_carts_enabled():
+        return {}
+    flushed = {}
+    for cart_id in Cart.objects.filter(user_id=user_id).values_list('id', flat=True):
+        items = cart_store().flush(str(cart_id))
+        if items is not None:
+            flushed[str(cart_id)] = items
+    return flushed
+
+
+def forget_carts(flushed):
+    """
+    After checkout emptied the carts, take the flushed lines out of Redis.
+    Lines added after the flush were not part of the order and stay, a
+    cart left empty is reloaded from the database on the next read.
+    """
+    for cart_id, items in flushed.items():
+        cart_store().forget_flushed(cart_id, items)
+
+
+def cart_item_payload(cart_id, product_id, quantity, summary):
+    # same shape as CartItemSerializer
+    return {
+        'id': product_id,
+        'cart': str(cart_id),
+        'product': summary,
+        'quantity': quantity,
+        'sub_total': quantity * Decimal(summary['price']),
+    }
+
+
+def cart_payload(cart_id, items):
+    """
+    Render {product_id: quantity} the way CartSerializer renders a Cart.
+    """
+    summaries = product_summaries(items)
+    lines = [cart_item_payload(cart_id, product_id, quantity, summaries[product_id])
+             for product_id, quantity in sorted(items.items()) if product_id in summaries]
+    return {
+        'id': str(cart_id),
+        'items': lines,
+        'cart_total': sum(line['sub_total'] for line in lines),
+        'total_quantity': sum(line['quantity'] for line in lines),
+    }
@@ -0,0 +1,46 @@
+from collections import Counter
+from django.db import transaction
+from .dispatch import normalize_postcode
+from .history import record_order
+from .inventory import reserve_stock
+from .models import Cart, CartItems, Order, OrderItem
+from .pricing import price_cart_items
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def place_order(user):
+    """
+    Turn everything in the user's carts into one order, in one transaction:
+    lock the carts, read and price the lines with their products in one
+    query, write the order lines in one insert at the prices just read,
+    empty the carts, record the order history and reserve the stock.
+    Raises EmptyCart, or OutOfStock with nothing written.
+
+    Locking the carts first queues a second checkout of the same carts, a
+    double submit, until this one commits and it finds them empty.
+    """
+    with transaction.atomic():
+        cart_ids = list(Cart.objects.select_for_update().filter(user=user).values_list('id', flat=True))
+        cart_items = CartItems.objects.filter(cart_id__in=cart_ids)
+        pricing = price_cart_items(cart_items)
+        if not pricing.lines:
+            raise EmptyCart
+
+        order = Order.objects.create(cart_id=pricing.lines[0].cart_id, total_cost=pricing.total, user=user,
+                                     postcode=normalize_postcode(user.postal_code))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=line.product_id, quantity=line.quantity, price=line.product.price)
+            for line in pricing.lines
+        ])
+        cart_items.delete()
+        record_order(order)
+
+        quantities = Counter()
+        for line in pricing.lines:
+            quantities[line.product_id] += line.quantity
+        # last, so the product rows are locked only until the commit
+        reserve_stock(order, quantities)
+    return order
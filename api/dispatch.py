@@ -0,0 +1,53 @@
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Order, OrderHistory
+
+
+def normalize_postcode(postcode):
+    return (postcode or '').replace(' ', '').upper()
+
+
+def dispatch_queue(postcode=None):
+    """
+    Paid orders nobody is delivering yet, oldest first, optionally only
+    those whose postcode starts with `postcode`, e.g. 'SW1' or 'M'.
+    """
+    queue = Order.objects.filter(status=Order.PAID, delivery_crew__isnull=True)
+    if postcode:
+        queue = queue.filter(postcode__startswith=normalize_postcode(postcode))
+    return queue.order_by('date_created', 'id')
+
+
+def claim_orders(crew, count, postcode=None):
+    """
+    Assign the next `count` orders of the dispatch queue to `crew` and
+    return their ids, oldest first.
+
+    With SKIP LOCKED, concurrent claims lock disjoint orders and never wait
+    on each other. Without it (SQLite) candidates are claimed with an
+    UPDATE that only takes orders still unassigned, and the ones another
+    claim won are replaced by the next in the queue.
+    """
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed = list(dispatch_queue(postcode).select_for_update(skip_locked=True)
+                           .values_list('pk', flat=True)[:count])
+            Order.objects.filter(pk__in=claimed).update(delivery_crew=crew, updated_at=now)
+            OrderHistory.objects.filter(order_id__in=claimed).update(updated_at=now)
+        return claimed
+
+    claimed = []
+    while len(claimed) < count:
+        candidates = list(dispatch_queue(postcode).values_list('pk', flat=True)[:count - len(claimed)])
+        if not candidates:
+            break
+        with transaction.atomic():
+            won = Order.objects.filter(pk__in=candidates, status=Order.PAID, delivery_crew__isnull=True).update(
+                delivery_crew=crew, updated_at=now)
+            if won != len(candidates):
+                candidates = list(Order.objects.filter(pk__in=candidates, delivery_crew=crew, updated_at=now)
+                                  .order_by('date_created', 'id').values_list('pk', flat=True))
+            OrderHistory.objects.filter(order_id__in=candidates).update(updated_at=now)
+        claimed += candidates
+    return claimed
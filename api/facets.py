@@ -0,0 +1,238 @@
+from collections import Counter
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from .cache import CATALOG_CACHE_SECONDS, bump_generation, get_generations
+from .models import Category, Product, ProductFacetCount
+
+
+# (label, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = [
+    ('0-25', 0, 25),
+    ('25-50', 25, 50),
+    ('50-100', 50, 100),
+    ('100-250', 100, 250),
+    ('250+', 250, None),
+]
+
+# a rating band is the whole number of stars, so band 4 covers 4.0 to 4.9,
+# band 1 also takes the half star ratings and band 5 is exactly 5
+RATING_BANDS = [1, 2, 3, 4, 5]
+
+FACETS = ('category', 'price_band', 'rating_band', 'featured', 'discount')
+
+FACET_FIELDS = ('category_id', 'price', 'rating', 'featured', 'discount')
+
+
+def price_band(price):
+    for label, lower, upper in PRICE_BANDS:
+        if price >= lower and (upper is None or price < upper):
+            return label
+    return PRICE_BANDS[0][0]
+
+
+def rating_band(rating):
+    return max(RATING_BANDS[0], min(int(rating), RATING_BANDS[-1]))
+
+
+def facet_key(category_id, price, rating, featured, discount):
+    return (category_id, price_band(Decimal(price)), rating_band(Decimal(rating)), featured, discount)
+
+
+def product_facet_key(product):
+    return facet_key(*(getattr(product, field) for field in FACET_FIELDS))
+
+
+def adjust_facet_count(key, delta):
+    category_id, price_band_label, rating_band_value, featured, discount = key
+    with transaction.atomic():
+        facet, _ = ProductFacetCount.objects.get_or_create(
+            category_id=category_id, price_band=price_band_label,
+            rating_band=rating_band_value, featured=featured, discount=discount)
+        ProductFacetCount.objects.filter(pk=facet.pk).update(count=F('count') + delta)
+    bump_generation('facets')
+
+
+def apply_facet_changes(old_keys, new_keys):
+    """
+    Move products between facet combinations, given their facet keys before
+    and after a write, with one UPDATE per combination that changed.
+    """
+    deltas = Counter(new_keys)
+    deltas.subtract(Counter(old_keys))
+    for key, delta in deltas.items():
+        if delta:
+            adjust_facet_count(key, delta)
+
+
+def rebuild_facet_counts():
+    """
+    Recount every facet combination from api_product, for writes that
+    bypass the Product signals such as bulk_create and bulk_update.
+    """
+    counts = Counter(
+        facet_key(*row) for row in
+        Product.objects.values_list(*FACET_FIELDS).order_by().iterator(chunk_size=2000))
+
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create([
+            ProductFacetCount(category_id=category_id, price_band=price_band_label,
+                              rating_band=rating_band_value, featured=featured,
+                              discount=discount, count=count)
+            for (category_id, price_band_label, rating_band_value, featured, discount), count
+            in counts.items()
+        ])
+    bump_generation('facets')
+
+
+def load_facet_cube():
+    """
+    Return the facet combinations with their product counts, plus category
+    titles, cached until the next facet change.
+    """
+    generations = get_generations(['facets', 'categories'])
+    key = 'catalog:facets:' + '.'.join(str(generation) for generation in generations)
+    cube = cache.get(key)
+    if cube is None:
+        cube = {
+            'rows': list(ProductFacetCount.objects.filter(count__gt=0).values_list(*FACETS, 'count')),
+            'categories': dict(Category.objects.values_list('id', 'title')),
+        }
+        cache.set(key, cube, CATALOG_CACHE_SECONDS)
+    return cube
+
+
+def facet_rows(queryset):
+    """
+    The facet combinations of `queryset` with their product counts, shaped
+    like the cube's rows, for result sets the precomputed counts do not
+    describe, such as a search.
+    """
+    counts = Counter(facet_key(*row) for row in queryset.order_by().values_list(*FACET_FIELDS))
+    return [(*key, count) for key, count in counts.items()]
+
+
+def facet_counts(selected, rows=None):
+    """
+    Count products per facet value, over the whole catalog or over `rows`
+    from facet_rows. Each facet is counted with every other selected facet
+    applied but not itself, so the client can see how many results picking
+    another value of the same facet would give.
+    """
+    cube = load_facet_cube()
+    counts = {facet: Counter() for facet in FACETS}
+
+    for row in cube['rows'] if rows is None else rows:
+        values, count = row[:-1], row[-1]
+        misses = [facet for facet, value in zip(FACETS, values)
+                  if facet in selected and value not in selected[facet]]
+        if not misses:
+            for facet, value in zip(FACETS, values):
+                counts[facet][value] += count
+        elif len(misses) == 1:
+            facet = misses[0]
+            counts[facet][values[FACETS.index(facet)]] += count
+
+    categories = cube['categories']
+    return {
+        'category': [{'value': value, 'label': categories.get(value), 'count': count}
+                     for value, count in sorted(counts['category'].items())],
+        'price_band': [{'value': label, 'count': counts['price_band'][label]}
+                       for label, _, _ in PRICE_BANDS if counts['price_band'][label]],
+        'rating_band': [{'value': band, 'count': counts['rating_band'][band]}
+                        for band in RATING_BANDS if counts['rating_band'][band]],
+        'featured': [{'value': value, 'count': count}
+                     for value, count in sorted(counts['featured'].items())],
+        'discount': [{'value': value, 'count': count}
+                     for value, count in sorted(counts['discount'].items())],
+    }
+
+
+def parse_price_band(value):
+    if value not in [label for label, _, _ in PRICE_BANDS]:
+        raise ValueError(value)
+    return value
+
+
+def parse_rating_band(value):
+    if int(value) not in RATING_BANDS:
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_boolean(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+
+def selected_facets(request):
+    """
+    Read the facet filters from the query string, e.g.
+    ?category=1,3&price_band=25-50&rating_band=4&featured=true
+    """
+    parsers = {
+        'category': int,
+        'price_band': parse_price_band,
+        'rating_band': parse_rating_band,
+        'featured': parse_boolean,
+        'discount': parse_boolean,
+    }
+    selected = {}
+    for facet, parse in parsers.items():
+        raw = request.query_params.get(facet)
+        if not raw:
+            continue
+        try:
+            selected[facet] = {parse(value.strip()) for value in raw.split(',')}
+        except ValueError:
+            raise ValidationError({facet: f'Invalid value: {raw}'})
+    return selected
+
+
+def facet_filter(selected):
+    condition = Q()
+    if 'category' in selected:
+        condition &= Q(category_id__in=selected['category'])
+    if 'price_band' in selected:
+        bands = Q()
+        for label, lower, upper in PRICE_BANDS:
+            if label in selected['price_band']:
+                band = Q(price__gte=lower)
+                if upper is not None:
+                    band &= Q(price__lt=upper)
+                bands |= band
+        condition &= bands
+    if 'rating_band' in selected:
+        bands = Q()
+        for band in selected['rating_band']:
+            if band == RATING_BANDS[-1]:
+                bands |= Q(rating__gte=band)
+            elif band == RATING_BANDS[0]:
+                bands |= Q(rating__lt=band + 1)
+            else:
+                bands |= Q(rating__gte=band, rating__lt=band + 1)
+        condition &= bands
+    for facet in ('featured', 'discount'):
+        if facet in selected:
+            condition &= Q(**{f'{facet}__in': selected[facet]})
+    return condition
+
+
+class ProductFacetFilter(BaseFilterBackend):
+    """
+    Filter products by category, price band, rating band, featured and
+    discount, each accepting a comma separated list of values.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        selected = selected_facets(request)
+        if not selected:
+            return queryset
+        return queryset.filter(facet_filter(selected))
@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from .models import Order, OrderHistory, OrderItem
+from .serializers import OrderSerializer
+
+
+ORDER_LINES = Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product').order_by('id'))
+
+
+def history_row(order):
+    # expects the order lines prefetched with ORDER_LINES
+    return OrderHistory(
+        order=order, user_id=order.user_id, date_created=order.date_created, updated_at=order.updated_at,
+        status=order.status, shipping_address=order.shipping_address, document=OrderSerializer(order).data)
+
+
+def record_order(order):
+    """
+    Write the history row of a new order. The lines are read back with
+    their products in one query, bulk_create does not return primary keys
+    on every database.
+    """
+    prefetch_related_objects([order], ORDER_LINES)
+    history = history_row(order)
+    history.save()
+    return history
+
+
+def sync_order_history(order):
+    # the order lines never change, only these fields do
+    OrderHistory.objects.filter(order_id=order.pk).update(
+        status=order.status, shipping_address=order.shipping_address, updated_at=order.updated_at)
+
+
+def order_payload(history):
+    """
+    The order as OrderSerializer renders it, from its history row alone.
+    """
+    return {**history.document, 'status': history.status, 'shipping_address': history.shipping_address}
+
+
+def rebuild_order_history(batch_size=500):
+    """
+    Rewrite the history of every order, in id order and one transaction
+    per batch. Returns how many orders were written.
+    """
+    written = 0
+    last_id = 0
+    while True:
+        orders = list(Order.objects.filter(pk__gt=last_id).order_by('pk').prefetch_related(ORDER_LINES)[:batch_size])
+        if not orders:
+            return written
+        with transaction.atomic():
+            OrderHistory.objects.filter(order__in=orders).delete()
+            OrderHistory.objects.bulk_create([history_row(order) for order in orders])
+        written += len(orders)
+        last_id = orders[-1].pk
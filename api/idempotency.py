@@ -0,0 +1,130 @@
+import hashlib
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+
+# how long a stored response is replayed for the same key
+IDEMPOTENCY_TTL_SECONDS = getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 60 * 60 * 24)
+
+# a request still running after this long is assumed dead and its key freed
+IDEMPOTENCY_LOCK_SECONDS = getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+
+# how long a duplicate waits for the request it duplicates
+IDEMPOTENCY_WAIT_SECONDS = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+
+IDEMPOTENCY_POLL_SECONDS = 0.05
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+class RequestInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed, retry later.'
+    default_code = 'request_in_progress'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class Replay(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def idempotency_key(request, key):
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    digest = hashlib.sha256(f'{user}:{request.method}:{request.path}:{key}'.encode('utf-8')).hexdigest()
+    return f'idempotency:{digest}'
+
+
+def fingerprint(request):
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def replay(stored):
+    content, status_code, content_type, request_fingerprint = stored
+    response = HttpResponse(content, status=status_code, content_type=content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyMixin:
+    """
+    Make the view's POSTs safe to retry. The first response for each
+    Idempotency-Key, per user and URL, is stored in the cache and every
+    retry gets it back without running the view again. A retry arriving
+    while the first request is still running waits for its response.
+
+    Keys are optional, requests without one run as usual. Server errors
+    are not stored, so the retry of a request that failed runs again.
+    """
+    idempotent_methods = ('POST',)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.idempotency = None
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if request.method not in self.idempotent_methods or not key:
+            return
+        if len(key) > 255:
+            raise ValidationError({'detail': f'{IDEMPOTENCY_HEADER} is limited to 255 characters.'})
+
+        cache_key = idempotency_key(request, key)
+        request_fingerprint = fingerprint(request)
+        lock_key = f'{cache_key}:lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            stored = cache.get(cache_key)
+            if stored is not None:
+                if stored[-1] != request_fingerprint:
+                    raise KeyReused()
+                raise Replay(replay(stored))
+            # the first request in takes the lock and runs, duplicates wait
+            if cache.add(lock_key, token, IDEMPOTENCY_LOCK_SECONDS):
+                self.idempotency = (cache_key, lock_key, token, request_fingerprint)
+                return
+            if time.monotonic() > deadline:
+                raise RequestInProgress()
+            time.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            self.release_idempotency_key()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        idempotency = getattr(self, 'idempotency', None)
+        if idempotency is None:
+            return response
+        cache_key, lock_key, token, request_fingerprint = idempotency
+        if response.status_code < 500:
+            if hasattr(response, 'render'):
+                response.render()
+            cache.set(cache_key, (response.content, response.status_code, response['Content-Type'],
+                                  request_fingerprint), IDEMPOTENCY_TTL_SECONDS)
+        self.release_idempotency_key()
+        return response
+
+    def release_idempotency_key(self):
+        idempotency = getattr(self, 'idempotency', None)
+        if idempotency is None:
+            return
+        self.idempotency = None
+        _, lock_key, token, _ = idempotency
+        # only our own lock, it may have expired and been taken by a retry
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
@@ -0,0 +1,140 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import InventoryReservation, Product
+
+
+logger = logging.getLogger(__name__)
+
+# how long stock stays held for an unpaid order
+INVENTORY_HOLD_SECONDS = getattr(settings, 'INVENTORY_HOLD_SECONDS', 60 * 35)
+
+# how long a checkout session stays open, kept inside the hold so a session
+# can never be paid after its stock went back on sale. Stripe refuses
+# sessions expiring less than 30 minutes after it creates them, the two
+# spare minutes absorb request latency and clock skew
+CHECKOUT_SESSION_SECONDS = 60 * 32
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Not enough stock for products {self.product_ids}')
+
+
+def take_stock(product_id, quantity):
+    """
+    Decrement the product's inventory if at least `quantity` is left, in a
+    single conditional UPDATE. There is no read-modify-write, so nothing
+    needs a SELECT ... FOR UPDATE and the row lock lasts only until the
+    surrounding transaction commits.
+    """
+    return Product.objects.filter(pk=product_id, inventory__gte=quantity).update(
+        inventory=F('inventory') - quantity) == 1
+
+
+def return_stock(quantities):
+    # products in id order, so concurrent releases lock rows in the same order
+    for product_id in sorted(quantities):
+        Product.objects.filter(pk=product_id).update(inventory=F('inventory') + quantities[product_id])
+
+
+def hold_expiry():
+    return timezone.now() + timedelta(seconds=INVENTORY_HOLD_SECONDS)
+
+
+def reserve_stock(order, lines):
+    """
+    Hold {product_id: quantity} for a new order, or raise OutOfStock. Call
+    it inside the transaction that creates the order, as its last write, so
+    the product rows stay locked for as short as possible and a failure
+    rolls the whole order back.
+    """
+    short = [product_id for product_id in sorted(lines) if not take_stock(product_id, lines[product_id])]
+    if short:
+        raise OutOfStock(short)
+
+    expires_at = hold_expiry()
+    InventoryReservation.objects.bulk_create([
+        InventoryReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in lines.items()
+    ])
+
+
+def renew_hold(order):
+    """
+    Restart the hold on the order's stock before it goes to payment, taking
+    stock again for holds that already expired. Raises OutOfStock.
+    """
+    with transaction.atomic():
+        expires_at = hold_expiry()
+        order.reservations.filter(status=InventoryReservation.HELD).update(expires_at=expires_at)
+        released = list(order.reservations.filter(status=InventoryReservation.RELEASED).order_by('product_id'))
+        short = [reservation.product_id for reservation in released
+                 if not take_stock(reservation.product_id, reservation.quantity)]
+        if short:
+            raise OutOfStock(short)
+        order.reservations.filter(pk__in=[reservation.pk for reservation in released]).update(
+            status=InventoryReservation.HELD, expires_at=expires_at)
+
+
+def confirm_stock(order):
+    """
+    Make the order's holds permanent once it is paid. Holds that expired in
+    the meantime take their stock again if there is any, the products left
+    short are logged and returned.
+    """
+    with transaction.atomic():
+        order.reservations.filter(status=InventoryReservation.HELD).update(status=InventoryReservation.CONFIRMED)
+        released = list(order.reservations.filter(status=InventoryReservation.RELEASED).order_by('product_id'))
+        taken = [reservation.pk for reservation in released
+                 if take_stock(reservation.product_id, reservation.quantity)]
+        order.reservations.filter(pk__in=taken).update(status=InventoryReservation.CONFIRMED)
+
+    short = [reservation.product_id for reservation in released if reservation.pk not in taken]
+    if short:
+        logger.error('Order %s was paid after its hold expired, products %s are oversold', order.pk, short)
+    return short
+
+
+def release_stock(order_ids):
+    """
+    Put the stock of cancelled orders back on sale.
+    """
+    with transaction.atomic():
+        reservations = list(InventoryReservation.objects.select_for_update().filter(order_id__in=order_ids).exclude(
+            status=InventoryReservation.RELEASED).values_list('pk', 'product_id', 'quantity'))
+        release(reservations)
+
+
+def release(reservations):
+    quantities = Counter()
+    for _, product_id, quantity in reservations:
+        quantities[product_id] += quantity
+    InventoryReservation.objects.filter(pk__in=[pk for pk, _, _ in reservations]).update(
+        status=InventoryReservation.RELEASED)
+    return_stock(quantities)
+
+
+def release_expired_reservations(batch_size=1000):
+    """
+    Give the stock of expired holds back, oldest first, one transaction per
+    batch. Rows locked by a confirmation in flight are skipped and left for
+    the next run. Returns how many holds were released.
+    """
+    lock = {'skip_locked': True} if connection.features.has_select_for_update_skip_locked else {}
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                InventoryReservation.objects.select_for_update(**lock)
+                .filter(status=InventoryReservation.HELD, expires_at__lt=timezone.now())
+                .order_by('expires_at').values_list('pk', 'product_id', 'quantity')[:batch_size])
+            release(expired)
+        released += len(expired)
+        if len(expired) < batch_size:
+            return released
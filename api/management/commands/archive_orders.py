@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from api.archive import CART_ARCHIVE_DAYS, ORDER_ARCHIVE_DAYS, archive_carts, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move old delivered or cancelled orders to ArchivedOrder and dead carts to compressed JSONL files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order-days', type=int, default=ORDER_ARCHIVE_DAYS,
+                            help='Archive delivered or cancelled orders unchanged for this many days')
+        parser.add_argument('--cart-days', type=int, default=CART_ARCHIVE_DAYS,
+                            help='Archive carts without orders untouched for this many days')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        orders = archive_orders(options['order_days'], options['batch_size'])
+        carts = archive_carts(options['cart_days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {orders} orders and {carts} carts in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py archive_orders --order-days 365 --cart-days 180
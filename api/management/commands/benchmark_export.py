@@ -0,0 +1,116 @@
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.exports import EXPORTS
+from api.models import Cart, Category, Order, OrderItem, Payment, Product
+from core.models import CustomUser
+from .export_orders import export_to
+
+
+BENCHMARK_SLUG = 'benchmark-export'
+
+
+def current_rss():
+    # resident set size in bytes, from /proc where there is one
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class Command(BaseCommand):
+    help = 'Measure export throughput and memory, optionally against seeded synthetic orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=200000,
+                            help='Number of synthetic orders to create first, with three lines and a payment each '
+                                 '(0 to use existing data)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic orders afterwards')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+        try:
+            for name, export in EXPORTS.items():
+                baseline = current_rss()
+                sampler = RssSampler()
+                sampler.start()
+                started = time.perf_counter()
+                count = export_to(os.devnull, export, options['format'], batch_size=options['batch_size'])
+                elapsed = time.perf_counter() - started
+                sampler.stop()
+                self.stdout.write(
+                    f'{name}: {count} rows in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} rows/s, '
+                    f'peak RSS {sampler.peak / 2 ** 20:.0f} MiB ({(sampler.peak - baseline) / 2 ** 20:+.1f} MiB)')
+        finally:
+            if options['seed'] and not options['keep']:
+                self.cleanup()
+
+    def seed(self, count, batch_size=5000):
+        started = time.perf_counter()
+        category, _ = Category.objects.get_or_create(slug=BENCHMARK_SLUG, defaults={'title': 'Benchmark'})
+        products = Product.objects.bulk_create([
+            Product(title=f'Benchmark product {i}', description='', image='https://example.com/benchmark.png',
+                    rating=4, price=10 + i, category=category)
+            for i in range(20)
+        ])
+        user = CustomUser.objects.create_user(f'{uuid.uuid4().hex}@{BENCHMARK_SLUG}.invalid')
+        cart = Cart.objects.create(user=user)
+        rng = random.Random(42)
+
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    Order(user=user, cart=cart, status=Order.PAID, total_cost=rng.randint(100, 9999) / 100,
+                          shipping_address='1 Benchmark Street\nLondon', postcode='SW1A1AA')
+                    for _ in range(size)
+                ])
+                if orders[0].pk is None:
+                    # bulk_create returns no keys on MySQL
+                    orders = list(Order.objects.filter(user=user).order_by('-pk')[:size])
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=product, quantity=rng.randint(1, 3), price=product.price)
+                    for order in orders for product in rng.sample(products, 3)
+                ])
+                Payment.objects.bulk_create([
+                    Payment(user=user, order=order, payment_method='card', amount_paid=order.total_cost,
+                            paymentintent_id=f'pi_{order.pk}', session_id=f'cs_{order.pk}')
+                    for order in orders
+                ])
+            created += size
+        self.stdout.write(f'Seeded {count} orders in {time.perf_counter() - started:.1f}s')
+
+    def cleanup(self):
+        CustomUser.objects.filter(email__endswith=f'@{BENCHMARK_SLUG}.invalid').delete()
+        Product.objects.filter(category__slug=BENCHMARK_SLUG).delete()
+        Category.objects.filter(slug=BENCHMARK_SLUG).delete()
+
+
+# python manage.py benchmark_export --seed 200000 --format jsonl
@@ -0,0 +1,93 @@
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import Sum
+from api.inventory import OutOfStock, reserve_stock
+from api.models import Cart, Category, InventoryReservation, Order, Product
+from core.models import CustomUser
+
+
+BENCHMARK_SLUG = 'benchmark-inventory'
+
+
+class Command(BaseCommand):
+    help = 'Race concurrent checkouts for one product and check that it is never oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=100, help='Units of the product on sale')
+        parser.add_argument('--checkouts', type=int, default=500, help='Number of competing checkouts')
+        parser.add_argument('--quantity', type=int, default=1, help='Units each checkout asks for')
+        parser.add_argument('--workers', type=int, default=50, help='Checkouts running at the same time')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite serializes writers, run this against the production database for meaningful timings'))
+
+        product, orders = self.seed(options['stock'], options['checkouts'])
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['workers']) as pool:
+                results = list(pool.map(
+                    lambda order: self.checkout(order, product.pk, options['quantity']), orders))
+            elapsed = time.perf_counter() - started
+            self.report(product, options, results, elapsed)
+        finally:
+            self.cleanup()
+
+    def checkout(self, order, product_id, quantity):
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                reserve_stock(order, {product_id: quantity})
+            outcome = 'sold'
+        except OutOfStock:
+            outcome = 'out of stock'
+        except OperationalError:
+            outcome = 'error'
+        finally:
+            close_old_connections()
+        return outcome, (time.perf_counter() - started) * 1000
+
+    def report(self, product, options, results, elapsed):
+        outcomes = [outcome for outcome, _ in results]
+        timings = sorted(timing for _, timing in results)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        sold = outcomes.count('sold')
+
+        product.refresh_from_db()
+        held = InventoryReservation.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+        self.stdout.write(
+            f'{len(results)} checkouts in {elapsed:.2f}s: {sold} sold, '
+            f'{outcomes.count("out of stock")} out of stock, {outcomes.count("error")} errors; '
+            f'p50 {statistics.median(timings):.1f}ms, p99 {p99:.1f}ms')
+        self.stdout.write(f'Inventory left {product.inventory}, {held} units held')
+
+        if product.inventory < 0 or held != options['stock'] - product.inventory or held != sold * options['quantity']:
+            raise CommandError('Oversold: stock, holds and sales do not add up')
+        expected = min(options['stock'] // options['quantity'], len(results))
+        if 'error' not in outcomes and sold != expected:
+            raise CommandError(f'Undersold: {sold} checkouts went through, {expected} should have')
+        self.stdout.write(self.style.SUCCESS('No overselling'))
+
+    def seed(self, stock, checkouts):
+        category, _ = Category.objects.get_or_create(slug=BENCHMARK_SLUG, defaults={'title': 'Benchmark'})
+        product = Product.objects.create(
+            title='Benchmark flash sale', description='', image='https://example.com/benchmark.png',
+            rating=5, price=10, category=category, inventory=stock)
+        user = CustomUser.objects.create_user(f'{uuid.uuid4().hex}@{BENCHMARK_SLUG}.invalid')
+        cart = Cart.objects.create(user=user)
+        orders = Order.objects.bulk_create(
+            [Order(user=user, cart=cart, total_cost=10) for _ in range(checkouts)])
+        return product, orders
+
+    def cleanup(self):
+        CustomUser.objects.filter(email__endswith=f'@{BENCHMARK_SLUG}.invalid').delete()
+        Product.objects.filter(category__slug=BENCHMARK_SLUG).delete()
+        Category.objects.filter(slug=BENCHMARK_SLUG).delete()
+
+
+# python manage.py benchmark_inventory --stock 100 --checkouts 500 --workers 50
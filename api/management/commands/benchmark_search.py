@@ -0,0 +1,84 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Category, Product
+from api.search import index_products, search_products
+
+
+BENCHMARK_SLUG = 'benchmark-search'
+
+WORDS = [
+    'red', 'blue', 'green', 'black', 'white', 'linen', 'cotton', 'silk', 'wool', 'leather',
+    'dress', 'shirt', 'skirt', 'jacket', 'coat', 'scarf', 'shoe', 'boot', 'sandal', 'hat',
+    'bag', 'belt', 'ring', 'necklace', 'bracelet', 'summer', 'winter', 'vintage', 'classic',
+    'slim', 'oversized', 'floral', 'striped', 'denim', 'velvet', 'satin', 'knit', 'party',
+]
+
+# long tail of rarer words so descriptions look more like real copy
+VOCABULARY = WORDS + [f'{first}{second}' for first in WORDS for second in WORDS if first != second]
+
+
+class Command(BaseCommand):
+    help = 'Measure full-text product search latency, optionally against seeded synthetic products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=100000,
+                            help='Number of synthetic products to create first (0 to use existing data)')
+        parser.add_argument('--runs', type=int, default=50, help='Timed runs per query')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic products afterwards')
+        parser.add_argument('queries', nargs='*', default=['red dress', 'leather boot', 'vintage silk scarf', 'zzz'])
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+
+        try:
+            total = Product.objects.count()
+            self.stdout.write(f'Searching {total} products, {options["runs"]} runs per query')
+            for query in options['queries']:
+                timings = []
+                for _ in range(options['runs']):
+                    started = time.perf_counter()
+                    results = list(search_products(Product.objects.all(), query)[:8])
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+                self.stdout.write(
+                    f'{query!r}: {len(results)} shown, '
+                    f'p50 {statistics.median(timings):.2f}ms, p99 {p99:.2f}ms')
+        finally:
+            if options['seed'] and not options['keep']:
+                self.cleanup()
+
+    def seed(self, count, batch_size=5000):
+        started = time.perf_counter()
+        category, _ = Category.objects.get_or_create(
+            slug=BENCHMARK_SLUG, defaults={'title': 'Benchmark'})
+        rng = random.Random(42)
+
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            products = [
+                Product(title=' '.join(rng.sample(WORDS, 3)),
+                        description=' '.join(rng.choices(VOCABULARY, k=30)),
+                        image='https://example.com/benchmark.png',
+                        rating=rng.randint(1, 5), price=rng.randint(1, 9999) / 100,
+                        category=category)
+                for _ in range(size)
+            ]
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+            created += size
+
+        index_products(Product.objects.filter(category=category).values_list('id', flat=True))
+        self.stdout.write(f'Seeded and indexed {count} products in {time.perf_counter() - started:.1f}s')
+
+    def cleanup(self):
+        Product.objects.filter(category__slug=BENCHMARK_SLUG).delete()
+        Category.objects.filter(slug=BENCHMARK_SLUG).delete()
+
+
+# python manage.py benchmark_search --seed 100000 "red dress"
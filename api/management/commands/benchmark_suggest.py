@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+from api.models import Category, Product
+from api.suggest import suggest_index
+from api.views import ProductViewset
+from .benchmark_search import VOCABULARY, WORDS
+
+
+BENCHMARK_SLUG = 'benchmark-suggest'
+
+
+def keystrokes(query):
+    # what a typeahead sends while the query is typed, from the second letter
+    return [query[:end] for end in range(2, len(query) + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Measure typeahead latency, keystroke by keystroke, optionally against seeded synthetic products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=100000,
+                            help='Number of synthetic products to create first (0 to use existing data)')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per keystroke')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic products afterwards')
+        parser.add_argument('queries', nargs='*',
+                            default=['red dress', 'leathr boot', 'vintage silk scarf', 'blue', 'zzz'])
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+
+        try:
+            started = time.perf_counter()
+            index = suggest_index()
+            self.stdout.write(
+                f'Indexed {len(index.products.entries)} product titles and '
+                f'{len(index.products.tokens)} distinct words in {time.perf_counter() - started:.1f}s')
+
+            view = ProductViewset.as_view({'get': 'suggest'})
+            factory = APIRequestFactory()
+            for query in options['queries']:
+                timings = []
+                for prefix in keystrokes(query):
+                    request = factory.get('/api/products/suggest/', {'q': prefix})
+                    for _ in range(options['runs']):
+                        started = time.perf_counter()
+                        response = view(request)
+                        timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+                shown = [product['title'] for product in response.data['products'][:3]]
+                self.stdout.write(
+                    f'{query!r}: p50 {statistics.median(timings):.2f}ms, p99 {p99:.2f}ms '
+                    f'over {len(timings)} requests, top {shown}')
+        finally:
+            if options['seed'] and not options['keep']:
+                self.cleanup()
+
+    def seed(self, count, batch_size=5000):
+        started = time.perf_counter()
+        category, _ = Category.objects.get_or_create(
+            slug=BENCHMARK_SLUG, defaults={'title': 'Benchmark'})
+        rng = random.Random(42)
+
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            products = [
+                Product(title=' '.join(rng.sample(WORDS, 2) + rng.sample(VOCABULARY, rng.randint(1, 3))),
+                        description='', image='https://example.com/benchmark.png',
+                        rating=rng.randint(1, 5), price=rng.randint(1, 9999) / 100,
+                        review_count=rng.randint(0, 500), category=category)
+                for _ in range(size)
+            ]
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+            created += size
+        self.stdout.write(f'Seeded {count} products in {time.perf_counter() - started:.1f}s')
+
+    def cleanup(self):
+        Product.objects.filter(category__slug=BENCHMARK_SLUG).delete()
+        Category.objects.filter(slug=BENCHMARK_SLUG).delete()
+
+
+# python manage.py benchmark_suggest --seed 100000 "red dre"
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from api.recommendations import RECOMMENDATIONS_PER_PRODUCT, RECOMMENDATIONS_STATE, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" recommendations from the orders placed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the saved co-occurrence counts and read every order again')
+        parser.add_argument('--limit', type=int, default=RECOMMENDATIONS_PER_PRODUCT,
+                            help='Neighbours kept per product')
+        parser.add_argument('--min-together', type=int, default=1,
+                            help='Orders two products must share before they are recommended')
+        parser.add_argument('--state', default=RECOMMENDATIONS_STATE,
+                            help='Where the co-occurrence counts are kept between runs')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = build_recommendations(
+            full=options['full'], limit=options['limit'],
+            min_together=options['min_together'], path=options['state'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} recommendations in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py build_recommendations
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from api.snapshots import SNAPSHOTS, SNAPSHOT_ROOT, build_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Render the landing page catalog responses to static JSON files with gzip and brotli variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the catalog has not changed since the last build')
+
+    def handle(self, *args, **options):
+        if build_snapshots(force=options['force']):
+            self.stdout.write(self.style.SUCCESS(
+                f'Built {len(SNAPSHOTS)} snapshots in {SNAPSHOT_ROOT}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Snapshots are up to date or being built'))
+
+
+# python manage.py build_snapshots --force
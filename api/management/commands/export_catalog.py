@@ -0,0 +1,60 @@
+import csv
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand
+from api.models import Product
+
+
+EXPORT_FIELDS = ['id', 'title', 'description', 'featured', 'image', 'rating', 'price',
+                 'category', 'discount', 'inventory']
+
+
+class Command(BaseCommand):
+    help = 'Stream the product catalog to a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or - for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        rows = (Product.objects.order_by('id')
+                .values_list(*[field if field != 'category' else 'category__slug' for field in EXPORT_FIELDS])
+                .iterator(chunk_size=options['batch_size']))
+
+        started = time.perf_counter()
+        target = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            count = self.write(target, rows, file_format)
+        finally:
+            if target is not sys.stdout:
+                target.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} products in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} rows/s'))
+
+    def write(self, target, rows, file_format):
+        count = 0
+        if file_format == 'csv':
+            writer = csv.writer(target)
+            writer.writerow(EXPORT_FIELDS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                record = dict(zip(EXPORT_FIELDS, row))
+                record['rating'] = str(record['rating'])
+                record['price'] = str(record['price'])
+                target.write(json.dumps(record) + '\n')
+                count += 1
+        return count
+
+
+# python manage.py export_catalog catalog.jsonl
@@ -0,0 +1,55 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.exports import EXPORT_FORMATS, EXPORTS, format_chunks, parse_bound
+
+
+class Command(BaseCommand):
+    help = 'Stream orders, order items or payments to a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('path', help="Output file, or - for stdout")
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS),
+                            help='Defaults to the file extension')
+        parser.add_argument('--since', help='Only rows on or after this date or datetime')
+        parser.add_argument('--until', help='Only rows before this date or datetime')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        count = export_to(path, EXPORTS[options['name']], file_format, since, until, options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} {options["name"]} in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} rows/s'))
+
+
+def export_to(path, export, file_format, since=None, until=None, batch_size=2000):
+    # returns the number of rows written
+    count = 0
+
+    def counted(batches):
+        nonlocal count
+        for rows in batches:
+            count += len(rows)
+            yield rows
+
+    target = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+    try:
+        for chunk in format_chunks(export, file_format, counted(export.batches(since, until, batch_size))):
+            target.write(chunk)
+    finally:
+        if target is not sys.stdout:
+            target.close()
+    return count
+
+
+# python manage.py export_orders orders orders.csv --since 2024-01-01 --until 2024-02-01
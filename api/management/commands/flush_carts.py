@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from api.carts import cart_store, redis_carts_enabled
+
+
+class Command(BaseCommand):
+    help = 'Write the carts changed in Redis since the last run back to Cart and CartItems'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not redis_carts_enabled():
+            self.stdout.write('CART_STORE is not redis, nothing to flush')
+            return
+        started = time.perf_counter()
+        flushed = cart_store().flush_dirty(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Flushed {flushed} carts in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py flush_carts
@@ -0,0 +1,126 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.bulk import bulk_upsert
+from api.cache import bump_generation
+from api.facets import rebuild_facet_counts
+from api.models import Category, Product
+from api.search import index_products
+from api.snapshots import build_snapshots
+
+
+IMPORT_FIELDS = ['title', 'description', 'featured', 'image', 'rating', 'price', 'discount', 'inventory']
+
+
+def parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', '1', 'yes')
+
+
+def read_rows(path, file_format):
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = 'Stream products from a CSV or JSONL file into the catalog in bulk batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        batch_size = options['batch_size']
+
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.created = self.updated = self.skipped = 0
+        started = time.perf_counter()
+
+        batch = []
+        try:
+            for line_number, row in enumerate(read_rows(path, file_format), start=1):
+                product = self.build_product(line_number, row)
+                if product is not None:
+                    batch.append(product)
+                if len(batch) >= batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            if batch:
+                self.write_batch(batch)
+        except FileNotFoundError:
+            raise CommandError(f'{path} does not exist')
+        finally:
+            if self.created or self.updated:
+                # bulk writes skip the Product signals, so refresh what they maintain
+                rebuild_facet_counts()
+                bump_generation('products', 'catalog')
+                build_snapshots()
+
+        elapsed = time.perf_counter() - started
+        total = self.created + self.updated
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} products ({self.created} created, {self.updated} updated, '
+            f'{self.skipped} skipped) in {elapsed:.1f}s, {total / max(elapsed, 1e-9):.0f} rows/s'))
+
+    def build_product(self, line_number, row):
+        try:
+            category_id = self.categories[row['category']]
+            product = Product(
+                title=row['title'],
+                description=row.get('description') or '',
+                featured=parse_boolean(row.get('featured', False)),
+                image=row['image'],
+                rating=Decimal(str(row['rating'])),
+                price=Decimal(str(row['price'])),
+                category_id=category_id,
+                discount=parse_boolean(row.get('discount', False)),
+                inventory=int(row.get('inventory') or 0),
+            )
+            if row.get('id'):
+                product.id = int(row['id'])
+            return product
+        except KeyError as e:
+            self.stderr.write(f'line {line_number}: missing or unknown {e}')
+        except (InvalidOperation, TypeError, ValueError):
+            self.stderr.write(f'line {line_number}: invalid rating, price or inventory')
+        self.skipped += 1
+        return None
+
+    @transaction.atomic
+    def write_batch(self, batch):
+        ids = [product.id for product in batch if product.id]
+        existing = set(Product.objects.filter(pk__in=ids).values_list('id', flat=True))
+        with_id = [product for product in batch if product.id]
+        without_id = [product for product in batch if not product.id]
+
+        bulk_upsert(Product, with_id, ['category', 'updated_at'] + IMPORT_FIELDS)
+
+        last_id = Product.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Product.objects.bulk_create(without_id)
+
+        touched = [product.id for product in with_id]
+        if any(product.id is None for product in without_id):
+            # the backend did not return the new primary keys
+            touched += list(Product.objects.filter(pk__gt=last_id).values_list('id', flat=True))
+        else:
+            touched += [product.id for product in without_id]
+        index_products(touched)
+
+        self.created += len(batch) - len(existing)
+        self.updated += len(existing)
+
+
+# python manage.py import_catalog supplier_feed.csv --batch-size 5000
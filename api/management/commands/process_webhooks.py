@@ -0,0 +1,95 @@
+import logging
+import multiprocessing
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from api.webhooks import process_events, requeue_dead_events, wait_for_events
+
+
+logger = logging.getLogger(__name__)
+
+
+def work(stop, batch_size, idle_seconds):
+    # one worker process: handle due events until the parent sets `stop`,
+    # which it does on SIGINT or SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            handled = process_events(batch_size)
+        except Exception:
+            # the database is unreachable or similar, try again shortly
+            logger.exception('Could not claim webhook events')
+            handled = 0
+        if not handled:
+            wait_for_events(stop, idle_seconds)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Handle queued Stripe webhook events in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--idle-seconds', type=float, default=1.0,
+                            help='How long an idle worker waits before looking for events again')
+        parser.add_argument('--once', action='store_true',
+                            help='Handle the events due now in this process and exit')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Give dead events a fresh set of attempts and exit')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            self.stdout.write(self.style.SUCCESS(f'Requeued {requeue_dead_events()} dead events'))
+            return
+
+        if options['once']:
+            started = time.perf_counter()
+            handled = 0
+            while True:
+                batch = process_events(options['batch_size'])
+                if not batch:
+                    break
+                handled += batch
+            self.stdout.write(self.style.SUCCESS(
+                f'Handled {handled} events in {time.perf_counter() - started:.1f}s'))
+            return
+
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        worker_args = (stop, options['batch_size'], options['idle_seconds'])
+
+        # setting `stop` from the handler could deadlock on its lock, the
+        # loop below sets it
+        stopping = []
+        signal.signal(signal.SIGINT, lambda *args: stopping.append(True))
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+        workers = []
+        for _ in range(options['workers']):
+            worker = context.Process(target=work, args=worker_args)
+            worker.start()
+            workers.append(worker)
+        self.stdout.write(f'Started {len(workers)} webhook workers')
+
+        while not stopping:
+            time.sleep(1)
+            for index, worker in enumerate(workers):
+                if not worker.is_alive() and not stopping:
+                    # a worker that died has its events taken over once their lease runs out
+                    self.stderr.write(f'Webhook worker {worker.pid} exited with {worker.exitcode}, restarting it')
+                    workers[index] = context.Process(target=work, args=worker_args)
+                    workers[index].start()
+
+        stop.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Webhook workers stopped'))
+
+
+# python manage.py process_webhooks --workers 4
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.facets import rebuild_facet_counts
+from api.models import ProductFacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the precomputed product facet counts from the product table'
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {ProductFacetCount.objects.count()} facet combinations'))
+
+
+# python manage.py rebuild_facets
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from api.history import rebuild_order_history
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the order history read model from the orders and their lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_order_history(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the history of {written} orders in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py rebuild_order_history
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.cache import bump_generation
+from api.ratings import rebuild_review_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute product review counts, average ratings and star histograms from the reviews'
+
+    def handle(self, *args, **options):
+        count = rebuild_review_stats()
+        bump_generation('products', 'catalog')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt review stats for {count} products'))
+
+
+# python manage.py rebuild_review_stats
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from api.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Put the stock of expired, unpaid inventory holds back on sale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        released = release_expired_reservations(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} holds in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py release_expired_reservations
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from api.models import Payment, SalesRollup
+from api.rollups import roll_up_payments
+
+
+class Command(BaseCommand):
+    help = 'Count the payments the live path missed into the hourly and daily sales roll-ups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop the roll-ups and count every payment again')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            SalesRollup.objects.all().delete()
+            Payment.objects.update(rollup_batch=None)
+        rolled_up = roll_up_payments(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {rolled_up} payments in {time.perf_counter() - started:.1f}s'))
+
+
+# python manage.py roll_up_sales
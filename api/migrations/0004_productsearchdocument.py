@@ -0,0 +1,87 @@
+# Generated by Django 5.0 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE api_productsearchdocument_fts USING fts5(
+        title, description, category_title,
+        content='api_productsearchdocument', content_rowid='product_id')""",
+    """CREATE TRIGGER api_productsearchdocument_ai AFTER INSERT ON api_productsearchdocument BEGIN
+        INSERT INTO api_productsearchdocument_fts(rowid, title, description, category_title)
+        VALUES (new.product_id, new.title, new.description, new.category_title);
+    END""",
+    """CREATE TRIGGER api_productsearchdocument_ad AFTER DELETE ON api_productsearchdocument BEGIN
+        INSERT INTO api_productsearchdocument_fts(api_productsearchdocument_fts, rowid, title, description, category_title)
+        VALUES ('delete', old.product_id, old.title, old.description, old.category_title);
+    END""",
+    """CREATE TRIGGER api_productsearchdocument_au AFTER UPDATE ON api_productsearchdocument BEGIN
+        INSERT INTO api_productsearchdocument_fts(api_productsearchdocument_fts, rowid, title, description, category_title)
+        VALUES ('delete', old.product_id, old.title, old.description, old.category_title);
+        INSERT INTO api_productsearchdocument_fts(rowid, title, description, category_title)
+        VALUES (new.product_id, new.title, new.description, new.category_title);
+    END""",
+]
+
+SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS api_productsearchdocument_au",
+    "DROP TRIGGER IF EXISTS api_productsearchdocument_ad",
+    "DROP TRIGGER IF EXISTS api_productsearchdocument_ai",
+    "DROP TABLE IF EXISTS api_productsearchdocument_fts",
+]
+
+MYSQL_FULLTEXT = [
+    """ALTER TABLE api_productsearchdocument
+        ADD FULLTEXT INDEX api_productsearch_title_ft (title),
+        ADD FULLTEXT INDEX api_productsearch_all_ft (title, description, category_title)""",
+]
+
+MYSQL_FULLTEXT_DROP = [
+    """ALTER TABLE api_productsearchdocument
+        DROP INDEX api_productsearch_title_ft,
+        DROP INDEX api_productsearch_all_ft""",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def build_documents(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductSearchDocument = apps.get_model('api', 'ProductSearchDocument')
+    documents = [
+        ProductSearchDocument(product_id=product_id, title=title,
+                              description=description, category_title=category_title)
+        for product_id, title, description, category_title in
+        Product.objects.values_list('id', 'title', 'description', 'category__title').iterator()
+    ]
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_payment_receipt_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='api.product')),
+                ('title', models.CharField(max_length=255)),
+                ('description', models.TextField()),
+                ('category_title', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FTS, 'mysql': MYSQL_FULLTEXT}),
+            run_for_vendor({'sqlite': SQLITE_FTS_DROP, 'mysql': MYSQL_FULLTEXT_DROP}),
+        ),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0 on 2026-10-18 12:07
+
+import django.db.models.deletion
+from collections import Counter
+from django.db import migrations, models
+
+
+def count_facets(apps, schema_editor):
+    # same bands as api.facets at the time of writing
+    price_bands = [('0-25', 25), ('25-50', 50), ('50-100', 100), ('100-250', 250)]
+    Product = apps.get_model('api', 'Product')
+    ProductFacetCount = apps.get_model('api', 'ProductFacetCount')
+
+    counts = Counter()
+    for category_id, price, rating, featured, discount in Product.objects.values_list(
+            'category_id', 'price', 'rating', 'featured', 'discount').iterator():
+        band = next((label for label, upper in price_bands if price < upper), '250+')
+        counts[(category_id, band, max(1, min(int(rating), 5)), featured, discount)] += 1
+
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=category_id, price_band=band, rating_band=rating_band,
+                          featured=featured, discount=discount, count=count)
+        for (category_id, band, rating_band, featured, discount), count in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_band', models.CharField(max_length=20)),
+                ('rating_band', models.PositiveSmallIntegerField()),
+                ('featured', models.BooleanField()),
+                ('discount', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='api.category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'price_band', 'rating_band', 'featured', 'discount'), name='unique_product_facet'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
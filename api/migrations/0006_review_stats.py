@@ -0,0 +1,54 @@
+# Generated by Django 5.0 on 2026-10-18 12:18
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_reviews(apps, schema_editor):
+    # existing reviews predate ratings, so only their counts need filling in
+    Product = apps.get_model('api', 'Product')
+    Review = apps.get_model('api', 'Review')
+    counts = Review.objects.values('product_id').annotate(count=Count('id')).values_list('product_id', 'count')
+    for product_id, count in counts.order_by():
+        Product.objects.filter(pk=product_id).update(review_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_productfacetcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductReviewStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_stats', serialize=False, to='api.product')),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
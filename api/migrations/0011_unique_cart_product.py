@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-18 12:42
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # fold repeated cart lines for the same product into the oldest one
+    CartItems = apps.get_model('api', 'CartItems')
+    duplicates = (CartItems.objects.filter(cart__isnull=False, product__isnull=False)
+                  .values('cart_id', 'product_id')
+                  .annotate(lines=Count('id'), first=Min('id'), quantity=Sum('quantity'))
+                  .filter(lines__gt=1).order_by())
+    for duplicate in duplicates:
+        CartItems.objects.filter(pk=duplicate['first']).update(quantity=duplicate['quantity'])
+        CartItems.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id']).exclude(
+            pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_review_feed_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitems',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0 on 2026-10-18 12:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Replace, Upper
+
+
+def copy_user_postcodes(apps, schema_editor):
+    # orders so far were delivered to the postcode on the customer's profile
+    CustomUser = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Order = apps.get_model('api', 'Order')
+    postcode = CustomUser.objects.filter(pk=OuterRef('user_id')).values(
+        normalized=Upper(Replace(Coalesce('postal_code', Value('')), Value(' '), Value(''))))[:1]
+    Order.objects.update(postcode=Coalesce(Subquery(postcode), Value('')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_orderhistory'),
+        # for CustomUser.postal_code
+        ('core', '0003_customuser_address_customuser_phone_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='postcode',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.RunPython(copy_user_postcodes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'delivery_crew', 'date_created', 'id'], name='dispatch_queue'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_order_postcode'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
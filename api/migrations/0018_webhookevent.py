@@ -0,0 +1,82 @@
+# Generated by Django 5.0 on 2026-10-18 13:00
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, F
+from api.rollups import payment_deltas
+
+
+def drop_duplicate_payments(apps, schema_editor):
+    # redelivered webhooks saved the same Checkout Session more than once,
+    # keep the first payment of each and take the others back out of the
+    # sales roll-ups that counted them
+    Payment = apps.get_model('api', 'Payment')
+    OrderItem = apps.get_model('api', 'OrderItem')
+    SalesRollup = apps.get_model('api', 'SalesRollup')
+    duplicates = (Payment.objects.filter(session_id__isnull=False).values('session_id')
+                  .annotate(payments=Count('id')).filter(payments__gt=1).order_by())
+    dropped = set()
+    for duplicate in duplicates:
+        payments = Payment.objects.filter(session_id=duplicate['session_id']).order_by('payment_date', 'pk')
+        dropped.update(payments.values_list('pk', flat=True)[1:])
+
+    # a batch counted the lines of an order once however many of its
+    # payments it took, so each batch is counted with and without the
+    # dropped payments and the difference taken back out
+    batches = set(Payment.objects.filter(pk__in=list(dropped), rollup_batch__isnull=False)
+                  .values_list('rollup_batch', flat=True))
+    for batch in batches:
+        payments = list(Payment.objects.filter(rollup_batch=batch).order_by('payment_date', 'pk')
+                        .values_list('pk', 'order_id', 'amount_paid', 'payment_date'))
+        kept = [payment[1:] for payment in payments if payment[0] not in dropped]
+        kept_orders = {order_id for order_id, _, _ in kept}
+        lines = list(OrderItem.objects.filter(order_id__in=list({payment[1] for payment in payments}))
+                     .values_list('order_id', 'product_id', 'product__category_id', 'quantity', 'price'))
+        counted = payment_deltas([payment[1:] for payment in payments], lines)
+        remaining = payment_deltas(kept, [line for line in lines if line[0] in kept_orders])
+        for key, delta in sorted(counted.items()):
+            revenue, orders, units = (value - left for value, left in zip(delta, remaining.get(key, (0, 0, 0))))
+            if not (revenue or orders or units):
+                continue
+            period, dimension, start, dimension_id = key
+            SalesRollup.objects.filter(
+                period=period, dimension=dimension, period_start=start, dimension_id=dimension_id,
+            ).update(revenue=F('revenue') - revenue, orders=F('orders') - orders, units=F('units') - units)
+
+    Payment.objects.filter(pk__in=list(dropped)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_archivedorder'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_payments, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='session_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('dead', 'Dead')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim', models.UUIDField(blank=True, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='webhook_queue')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='confirmation_due',
+            field=models.BooleanField(default=False),
+        ),
+    ]
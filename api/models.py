@@ -1,6 +1,9 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from core.models import CustomUser
 import uuid
+from decimal import Decimal
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 # Create your models here.
@@ -26,11 +29,52 @@ class Product(models.Model):
         Category, on_delete=models.PROTECT, related_name='products')
     discount = models. BooleanField(default=False)
     inventory = models.IntegerField(default=5)
+    # maintained from the reviews by api/ratings.py
+    review_count = models.PositiveIntegerField(default=0, db_index=True)
+    rating_avg = models.DecimalField(
+        max_digits=3, decimal_places=2, default=0, db_index=True)
+    # bulk writers have to list it in their update fields, see api/suggest.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self) -> str:
         return self.title
 
 
+class ProductSearchDocument(models.Model):
+    # denormalized copy of the searchable text, carrying the full-text index
+    # (FULLTEXT on MySQL, an FTS5 shadow table on SQLite, see migration 0004)
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    title = models.CharField(max_length=255)
+    description = models.TextField()
+    category_title = models.CharField(max_length=255)
+
+    def __str__(self) -> str:
+        return self.title
+
+
+class ProductFacetCount(models.Model):
+    # number of products per combination of facet values, kept current by
+    # api/signals.py so facet counts never need a GROUP BY over api_product
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name='facet_counts')
+    price_band = models.CharField(max_length=20)
+    rating_band = models.PositiveSmallIntegerField()
+    featured = models.BooleanField()
+    discount = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'price_band', 'rating_band', 'featured', 'discount'],
+                name='unique_product_facet'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.category_id}/{self.price_band}/{self.rating_band}: {self.count}"
+
+
 class Review(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     product = models.ForeignKey(
@@ -38,16 +82,51 @@ class Review(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     description = models.TextField(default="description")
     name = models.CharField(max_length=50)
+    rating = models.PositiveSmallIntegerField(blank=True, null=True, validators=[
+                                              MinValueValidator(1), MaxValueValidator(5)])
+
+    class Meta:
+        indexes = [
+            # the per-product feed seeks on (date_created, id) within a product
+            models.Index(fields=['product', 'date_created', 'id'], name='review_feed'),
+        ]
 
     def __str__(self):
         return self.description
 
 
+class ProductReviewStats(models.Model):
+    # running totals behind Product.rating_avg plus the star histogram
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='review_stats')
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.product_id}: {self.rating_count} ratings"
+
+    def histogram(self):
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+    def average(self):
+        if not self.rating_count:
+            return Decimal(0)
+        return (Decimal(self.rating_sum) / self.rating_count).quantize(Decimal('0.01'))
+
+
 class Cart(models.Model):
     id = models.UUIDField(default=uuid.uuid4, primary_key=True)
     user = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name='shopping_cart')
     created_at = models.DateTimeField(auto_now_add=True)
+    # last write to the cart's items, a user's one cart lives for years,
+    # so this and not created_at tells an abandoned cart, see api/archive.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     completed = models.BooleanField(default=False)
     selected_items = models.ManyToManyField(
         Product, through='CartItems', related_name='cart_products')
@@ -63,6 +142,12 @@ class CartItems(models.Model):
         Product, on_delete=models.CASCADE, blank=True, null=True, related_name='cartitems')
     quantity = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            # lets concurrent adds insert-or-increment without duplicate lines
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self) -> str:
         return f"{self.product}  in {self.cart}"
 
@@ -78,6 +163,11 @@ class Order(models.Model):
         (DELIVERED, 'Delivered'),
         (CANCELLED, 'Cancelled'),
     )
+    # the statuses an order may move to from each status, see api/transitions.py
+    TRANSITIONS = {
+        PENDING: (PAID, CANCELLED),
+        PAID: (DELIVERED, CANCELLED),
+    }
 
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     delivery_crew = models.ForeignKey(
@@ -85,10 +175,19 @@ class Order(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     status = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default=PENDING)
-    date_created = models.DateTimeField(auto_now_add=True)
+    date_created = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
     shipping_address = models.TextField()
+    # upper case and without spaces, so dispatch can group by its prefix
+    postcode = models.CharField(max_length=10, blank=True, default='')
     total_cost = models.DecimalField(max_digits=6, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # the dispatch queue: paid, unassigned orders, oldest first
+            models.Index(fields=['status', 'delivery_crew', 'date_created', 'id'], name='dispatch_queue'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} ({self.status})"
 
@@ -106,18 +205,201 @@ class OrderItem(models.Model):
         return self.quantity * self.price
 
 
+class OrderHistory(models.Model):
+    # read model behind the order listings: the order as OrderSerializer
+    # renders it, written at checkout by api/history.py, with the fields
+    # that change afterwards kept in sync by a signal
+    order = models.OneToOneField(
+        Order, on_delete=models.CASCADE, related_name='history')
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='+')
+    date_created = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    shipping_address = models.TextField(blank=True)
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            # a customer's orders, newest first, seeked by KeysetPagination
+            models.Index(fields=['user', 'date_created', 'id'], name='order_history_feed'),
+        ]
+
+    def __str__(self) -> str:
+        return f"History of order {self.order_id}"
+
+
+class ArchivedOrder(models.Model):
+    # a delivered or cancelled order moved out of the hot tables by
+    # api/archive.py, keeping its id
+    id = models.PositiveIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    date_created = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    # the order as OrderSerializer renders it
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+    # cart, delivery crew, postcode and payment ids
+    details = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self) -> str:
+        return f"Archived order {self.id} ({self.status})"
+
+
+class InventoryReservation(models.Model):
+    # stock taken off Product.inventory for an order, held until the payment
+    # is confirmed or the hold expires, see api/inventory.py
+    HELD = 'held'
+    CONFIRMED = 'confirmed'
+    RELEASED = 'released'
+    STATUS_CHOICES = (
+        (HELD, 'Held'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released'),
+    )
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the release job scans the expired holds oldest first
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.quantity} x {self.product_id} for order {self.order_id} ({self.status})"
+
+
+class ProductRecommendation(models.Model):
+    # top neighbours of a product by how often they are ordered together,
+    # written by the build_recommendations command
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='recommendations')
+    related_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    together = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-score'], name='recommendation_rank'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'related_product'], name='unique_product_recommendation'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.product_id} -> {self.related_product_id} ({self.score:.3f})"
+
+
 class Payment(models.Model):
     id = models.UUIDField(default=uuid.uuid4, primary_key=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # payments outlive their order when it is archived, see api/archive.py
     order = models.ForeignKey(
-        Order, on_delete=models.CASCADE, related_name='payments')
+        Order, on_delete=models.SET_NULL, null=True, related_name='payments')
     payment_method = models.CharField(max_length=50)
     paymentintent_id = models.CharField(max_length=100, blank=True, null=True)
-    session_id = models.CharField(max_length=100, blank=True, null=True)
+    # one payment per Checkout Session, however often Stripe sends the event
+    session_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     amount_paid = models.DecimalField(
         max_digits=6, decimal_places=2, db_index=True)
-    payment_date = models.DateTimeField(auto_now_add=True)
+    payment_date = models.DateTimeField(auto_now_add=True, db_index=True)
     receipt_url = models.URLField(max_length=255, blank=True, null=True)
+    # the roll-up run that counted this payment in SalesRollup, null until
+    # one has, see api/rollups.py
+    rollup_batch = models.UUIDField(blank=True, null=True, db_index=True)
+    # set when the payment marks its order paid, cleared once the
+    # confirmation email is sent, see api/webhooks.py
+    confirmation_due = models.BooleanField(default=False)
+
+    def __str__(self) -> str:
+        return f"{self.user}'s payment for the order {self.order_id}"
+
+
+class SalesRollup(models.Model):
+    # sales per hour and per day, in total, per product and per category,
+    # added to as payments come in by api/rollups.py
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+    TOTAL = 'total'
+    PRODUCT = 'product'
+    CATEGORY = 'category'
+    DIMENSION_CHOICES = (
+        (TOTAL, 'Total'),
+        (PRODUCT, 'Product'),
+        (CATEGORY, 'Category'),
+    )
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    period_start = models.DateTimeField()
+    # product or category id, 0 for the totals
+    dimension_id = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # also the index behind the report's range scans
+            models.UniqueConstraint(fields=['period', 'dimension', 'period_start', 'dimension_id'],
+                                    name='unique_sales_rollup'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.dimension} {self.dimension_id} sales for the {self.period} from {self.period_start}"
+
+
+class WebhookEvent(models.Model):
+    # a Stripe event as received, queued until a process_webhooks worker
+    # has handled it, see api/webhooks.py
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    )
+
+    # Stripe's event id, so a redelivered event is recorded once
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # the worker run holding the event and until when, a crashed worker's
+    # events are picked up again once this has passed
+    claim = models.UUIDField(blank=True, null=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the queue: due events, oldest first
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_queue'),
+        ]
 
     def __str__(self) -> str:
-        return f"{self.user}'s payment for the order {self.order.id}"
+        return f"{self.event_type} {self.event_id} ({self.status})"
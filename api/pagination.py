@@ -0,0 +1,131 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductPagination(PageNumberPagination):
+    page_size = 8
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on (ordering field, id) instead of using
+    OFFSET, so every page costs one indexed range scan and no COUNT(*).
+
+    The ordering is picked from `?ordering=` and limited to the view's
+    `ordering_fields`; `id` always breaks ties.
+    """
+    page_size = 8
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    default_ordering = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.field, self.descending = self.get_ordering(request, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor['reverse']
+        queryset = queryset.order_by(*self.order_by(reverse))
+        if self.cursor is not None:
+            queryset = queryset.filter(self.seek(self.cursor, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_ordering(self, request, view):
+        allowed = getattr(view, 'ordering_fields', None) or [self.default_ordering]
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        field = ordering.lstrip('-')
+        if field not in allowed:
+            ordering = self.default_ordering
+            field = ordering.lstrip('-')
+        return field, ordering.startswith('-')
+
+    def order_by(self, reverse):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        if self.field == 'id':
+            return [prefix + 'id']
+        return [prefix + self.field, prefix + 'id']
+
+    def seek(self, cursor, reverse):
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{lookup}': cursor['id']})
+        # the redundant inclusive bound lets the database range scan the
+        # index instead of evaluating the OR for every row
+        return (Q(**{f'{self.field}__{lookup}e': cursor['value']}) &
+                (Q(**{f'{self.field}__{lookup}': cursor['value']}) | Q(**{f'id__{lookup}': cursor['id']})))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'))
+            return {
+                'id': int(tokens['i'][0]),
+                'value': tokens.get('v', [None])[0],
+                'reverse': bool(int(tokens.get('r', ['0'])[0])),
+            }
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        tokens = {'i': instance.pk}
+        if self.field != 'id':
+            tokens['v'] = getattr(instance, self.field)
+        if reverse:
+            tokens['r'] = 1
+        encoded = b64encode(parse.urlencode(tokens).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+class ProductCursorPagination(KeysetPagination):
+    page_size = 8
+
+
+class ReviewPagination(KeysetPagination):
+    page_size = 10
+    default_ordering = '-date_created'
+
+
+class OrderHistoryPagination(KeysetPagination):
+    page_size = 10
+    default_ordering = '-date_created'
@@ -0,0 +1,49 @@
+from decimal import Decimal
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+from .models import CartItems, OrderItem
+
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total(price):
+    return ExpressionWrapper(F('quantity') * F(price), output_field=MONEY)
+
+
+def priced_lines(queryset, price='product__price'):
+    """
+    Load the lines with their product and annotate each with its
+    `line_total`, plus the `lines_total` and `lines_quantity` of the whole
+    queryset as window sums, so one query prices the entire cart or order.
+    """
+    return queryset.select_related('product').annotate(
+        line_total=line_total(price),
+        lines_total=Window(Sum(line_total(price)), output_field=MONEY),
+        lines_quantity=Window(Sum('quantity')),
+    )
+
+
+class Pricing:
+    """
+    Line subtotals, total and total quantity of a cart or an order.
+    """
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        first = self.lines[0] if self.lines else None
+        # SQLite returns the window sum without its scale
+        self.total = (first.lines_total if first else Decimal(0)).quantize(Decimal('0.01'))
+        self.quantity = first.lines_quantity if first else 0
+
+
+def price_cart_items(cart_items):
+    return Pricing(priced_lines(cart_items.order_by('id')))
+
+
+def price_cart(cart_id):
+    return price_cart_items(CartItems.objects.filter(cart_id=cart_id))
+
+
+def price_order(order):
+    # order lines keep the price paid, not the current product price
+    return Pricing(priced_lines(OrderItem.objects.filter(order=order).order_by('id'), price='price'))
@@ -0,0 +1,80 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from .models import Product, ProductReviewStats, Review
+
+
+def star_field(rating):
+    return f'stars_{rating}'
+
+
+def average_rating():
+    return Round(Cast('rating_sum', DecimalField(max_digits=12, decimal_places=2)) /
+                 NullIf(F('rating_count'), 0), 2)
+
+
+def apply_review_change(product_id, previous_rating=None, rating=None, review_delta=0):
+    """
+    Fold one review change into the product's totals with F() updates: a
+    new review passes rating and review_delta=1, a deleted one passes
+    previous_rating and review_delta=-1, an edit passes both ratings.
+    """
+    deltas = Counter()
+    if previous_rating is not None:
+        deltas['rating_count'] -= 1
+        deltas['rating_sum'] -= previous_rating
+        deltas[star_field(previous_rating)] -= 1
+    if rating is not None:
+        deltas['rating_count'] += 1
+        deltas['rating_sum'] += rating
+        deltas[star_field(rating)] += 1
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+
+    with transaction.atomic():
+        if updates:
+            if rating is not None and previous_rating is None:
+                # make sure there is a row to add to; when two first reviews
+                # race, both inserts succeed and one of them does nothing
+                ProductReviewStats.objects.bulk_create(
+                    [ProductReviewStats(product_id=product_id)], ignore_conflicts=True)
+            ProductReviewStats.objects.filter(product_id=product_id).update(**updates)
+
+        product_updates = {}
+        if review_delta:
+            product_updates['review_count'] = F('review_count') + review_delta
+        if updates:
+            product_updates['rating_avg'] = Coalesce(Subquery(
+                ProductReviewStats.objects.filter(product_id=OuterRef('pk'))
+                .annotate(average=average_rating()).values('average')[:1]), 0,
+                output_field=DecimalField(max_digits=3, decimal_places=2))
+        if product_updates:
+            Product.objects.filter(pk=product_id).update(**product_updates)
+
+
+def rebuild_review_stats(batch_size=1000):
+    """
+    Recompute every product's review count, average rating and histogram
+    from the review table.
+    """
+    review_counts = dict(Review.objects.values('product_id').annotate(count=Count('id'))
+                         .values_list('product_id', 'count').order_by())
+    stats = {}
+    for product_id, rating, count in (Review.objects.filter(rating__isnull=False)
+                                      .values('product_id', 'rating').annotate(count=Count('id'))
+                                      .values_list('product_id', 'rating', 'count').order_by()):
+        row = stats.setdefault(product_id, ProductReviewStats(product_id=product_id))
+        row.rating_count += count
+        row.rating_sum += rating * count
+        setattr(row, star_field(rating), count)
+
+    with transaction.atomic():
+        ProductReviewStats.objects.all().delete()
+        ProductReviewStats.objects.bulk_create(stats.values(), batch_size=batch_size)
+        Product.objects.filter(review_count__gt=0).update(review_count=0, rating_avg=0)
+        Product.objects.bulk_update([
+            Product(pk=product_id, review_count=count, rating_avg=stats[product_id].average()
+                    if product_id in stats else 0)
+            for product_id, count in review_counts.items()
+        ], ['review_count', 'rating_avg'], batch_size=batch_size)
+    return len(review_counts)
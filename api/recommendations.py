@@ -0,0 +1,189 @@
+import os
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from scipy import sparse
+from .models import Order, OrderItem, Product, ProductRecommendation
+
+
+RECOMMENDATIONS_PER_PRODUCT = 20
+
+# co-occurrence counts and the last order folded into them, so a run only
+# reads the order lines added since the previous one
+RECOMMENDATIONS_STATE = getattr(
+    settings, 'RECOMMENDATIONS_STATE', os.path.join(settings.BASE_DIR, 'recommendations.npz'))
+
+# orders placed this recently are read again by the next run: an order
+# whose transaction commits after a higher id was read would otherwise be
+# skipped for good
+RECOMMENDATIONS_OVERLAP_SECONDS = getattr(settings, 'RECOMMENDATIONS_OVERLAP_SECONDS', 60 * 60)
+
+
+class CooccurrenceState:
+    """
+    For every pair of products, the number of orders containing both
+    (`together`, a symmetric sparse matrix indexed by product id), and for
+    every product the number of orders containing it (`orders`).
+
+    Every order up to `last_order_id` is counted, and so are the later
+    ones in `counted`, which the overlap reads again without counting twice.
+    """
+
+    def __init__(self, together=None, orders=None, last_order_id=0, counted=None):
+        self.together = together if together is not None else sparse.csr_matrix((1, 1), dtype=np.int64)
+        self.orders = orders if orders is not None else np.zeros(1, dtype=np.int64)
+        self.last_order_id = last_order_id
+        self.counted = counted if counted is not None else np.array([], dtype=np.int64)
+
+    @classmethod
+    def load(cls, path=RECOMMENDATIONS_STATE):
+        with np.load(path) as state:
+            together = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape']))
+            # states saved before the overlap have no counted ids
+            counted = state['counted'] if 'counted' in state.files else None
+            return cls(together, state['orders'], int(state['last_order_id']), counted)
+
+    def save(self, path=RECOMMENDATIONS_STATE):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as target:
+            np.savez_compressed(
+                target, data=self.together.data, indices=self.together.indices,
+                indptr=self.together.indptr, shape=np.array(self.together.shape),
+                orders=self.orders, last_order_id=np.array(self.last_order_id), counted=self.counted)
+        os.replace(temporary, path)
+
+    def resize(self, size):
+        if size > self.together.shape[0]:
+            self.together.resize((size, size))
+            self.orders = np.pad(self.orders, (0, size - len(self.orders)))
+
+    def add(self, lines):
+        """
+        Fold an (n, 2) array of (order id, product id) lines into the counts.
+        Lines of one order must all be in the same call.
+        """
+        if not len(lines):
+            return
+        self.resize(int(lines[:, 1].max()) + 1)
+        _, baskets = np.unique(lines[:, 0], return_inverse=True)
+        size = self.together.shape[0]
+        basket = sparse.csr_matrix(
+            (np.ones(len(lines), dtype=np.int64), (baskets, lines[:, 1])), shape=(baskets.max() + 1, size))
+        # a product on two lines of the same order still counts once
+        basket.sum_duplicates()
+        basket.data[:] = 1
+
+        together = (basket.T @ basket).tocsr()
+        self.orders += together.diagonal()
+        together.setdiag(0)
+        together.eliminate_zeros()
+        self.together = (self.together + together).tocsr()
+
+
+def order_lines(after_order_id, up_to_order_id, batch_orders=50000):
+    """
+    Yield (order id, product id) arrays for consecutive ranges of order ids,
+    so every order is read whole and memory stays bounded by the range.
+    """
+    lines = (OrderItem.objects.exclude(order__status=Order.CANCELLED)
+             .order_by().values_list('order_id', 'product_id'))
+    for start in range(after_order_id, up_to_order_id, batch_orders):
+        rows = lines.filter(order_id__gt=start, order_id__lte=min(start + batch_orders, up_to_order_id))
+        flat = np.fromiter((value for row in rows.iterator(chunk_size=10000) for value in row), dtype=np.int64)
+        yield flat.reshape(-1, 2)
+
+
+def top_neighbours(state, products, limit=RECOMMENDATIONS_PER_PRODUCT, min_together=1):
+    """
+    Return (product, neighbour, score, together) arrays with the `limit`
+    best neighbours of each given product. The score is the cosine
+    similarity of the two products' order sets, so a bestseller does not
+    become everyone's top neighbour.
+    """
+    together = state.together
+    rows = np.repeat(np.arange(together.shape[0]), np.diff(together.indptr))
+    scores = together.data / np.sqrt(state.orders[rows] * state.orders[together.indices])
+    scores[together.data < min_together] = -np.inf
+
+    # rows stay grouped as in the CSR layout, best score first within a row
+    order = np.lexsort((-scores, rows))
+    rank = np.arange(len(order)) - together.indptr[rows[order]]
+    keep = order[(rank < limit) & np.isin(rows[order], products) & np.isfinite(scores[order])]
+    return rows[keep], together.indices[keep], scores[keep], together.data[keep]
+
+
+def write_recommendations(products, neighbours, scores, together, affected, batch_size=5000):
+    """
+    Replace the stored recommendations of the affected products, or of every
+    product when `affected` is None, a batch of products per transaction.
+    """
+    existing = np.fromiter(Product.objects.order_by().values_list('id', flat=True), dtype=np.int64)
+    valid = np.isin(products, existing) & np.isin(neighbours, existing)
+    products, neighbours, scores, together = products[valid], neighbours[valid], scores[valid], together[valid]
+
+    affected = existing if affected is None else np.intersect1d(affected, existing)
+    written = 0
+    for start in range(0, len(affected), batch_size):
+        batch = affected[start:start + batch_size]
+        selected = np.isin(products, batch)
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__in=batch.tolist()).delete()
+            ProductRecommendation.objects.bulk_create([
+                ProductRecommendation(product_id=product, related_product_id=neighbour,
+                                      score=score, together=count)
+                for product, neighbour, score, count in zip(
+                    products[selected].tolist(), neighbours[selected].tolist(),
+                    scores[selected].tolist(), together[selected].tolist())
+            ], batch_size=1000)
+        written += int(selected.sum())
+    return written
+
+
+def build_recommendations(full=False, limit=RECOMMENDATIONS_PER_PRODUCT, min_together=1,
+                          path=RECOMMENDATIONS_STATE):
+    """
+    Fold the orders placed since the last run into the co-occurrence counts
+    and rewrite the neighbours of every product whose scores moved. With
+    `full`, or without a saved state, every order is read again.
+    """
+    full = full or not os.path.exists(path)
+    state = CooccurrenceState() if full else CooccurrenceState.load(path)
+    up_to_order_id = Order.objects.aggregate(last=Max('id'))['last'] or 0
+    # orders older than the overlap have long committed, the ids up to the
+    # newest of them are settled and never need reading again
+    settled = Order.objects.filter(
+        date_created__lt=timezone.now() - timedelta(seconds=RECOMMENDATIONS_OVERLAP_SECONDS),
+    ).aggregate(last=Max('id'))['last'] or 0
+
+    changed = []
+    for lines in order_lines(state.last_order_id, up_to_order_id):
+        lines = lines[~np.isin(lines[:, 0], state.counted)]
+        if not len(lines):
+            continue
+        state.add(lines)
+        state.counted = np.union1d(state.counted, lines[:, 0])
+        changed.append(np.unique(lines[:, 1]))
+    state.last_order_id = max(state.last_order_id, min(settled, up_to_order_id))
+    state.counted = state.counted[state.counted > state.last_order_id]
+
+    if full:
+        affected = None
+    elif changed:
+        changed = np.unique(np.concatenate(changed))
+        # a neighbour's order count is part of the score, so its own
+        # neighbours have to be ranked again as well
+        affected = np.union1d(changed, state.together[changed].indices)
+    else:
+        affected = np.array([], dtype=np.int64)
+
+    written = 0
+    if affected is None or len(affected):
+        products = np.arange(state.together.shape[0]) if affected is None else affected
+        written = write_recommendations(
+            *top_neighbours(state, products, limit, min_together), affected)
+    state.save(path)
+    return written
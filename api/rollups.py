@@ -0,0 +1,164 @@
+import logging
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Category, OrderItem, Payment, Product, SalesRollup
+
+
+logger = logging.getLogger(__name__)
+
+REPORT_TOP = 10
+
+
+def period_start(moment, period):
+    # buckets follow TIME_ZONE, so a day is the store's day
+    moment = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    if period == SalesRollup.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def claim_payments(payment_ids=None, batch_size=1000):
+    """
+    Mark up to `batch_size` payments not rolled up yet as taken by a new
+    batch, returning (batch id, payments taken), or None when there are
+    none left. The UPDATE only takes payments nobody took, so the live path
+    and the catch-up command never count one twice.
+    """
+    batch = uuid.uuid4()
+    pending = Payment.objects.filter(rollup_batch__isnull=True)
+    if payment_ids is not None:
+        pending = pending.filter(pk__in=payment_ids)
+    candidates = list(pending.values_list('pk', flat=True)[:batch_size])
+    if not candidates:
+        return None
+    return batch, Payment.objects.filter(pk__in=candidates, rollup_batch__isnull=True).update(rollup_batch=batch)
+
+
+def sales_deltas(batch):
+    """
+    What the payments of a batch add to each roll-up row, as
+    {(period, dimension, period_start, dimension_id): [revenue, orders, units]}.
+    """
+    payments = list(Payment.objects.filter(rollup_batch=batch).order_by('payment_date', 'pk')
+                    .values_list('order_id', 'amount_paid', 'payment_date'))
+    lines = (OrderItem.objects.filter(order_id__in=list({order_id for order_id, _, _ in payments}))
+             .values_list('order_id', 'product_id', 'product__category_id', 'quantity', 'price'))
+    return payment_deltas(payments, lines)
+
+
+def payment_deltas(payments, lines):
+    """
+    The deltas of (order id, amount paid, payment date) payments counted in
+    one batch, given the (order id, product id, category id, quantity,
+    price) lines of their orders. Migration 0018 uses it as well.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0, 0])
+    paid_at = {}
+    for order_id, amount_paid, payment_date in payments:
+        paid_at[order_id] = payment_date
+        for period in (SalesRollup.HOUR, SalesRollup.DAY):
+            delta = deltas[(period, SalesRollup.TOTAL, period_start(payment_date, period), 0)]
+            delta[0] += amount_paid
+            delta[1] += 1
+
+    counted = set()
+    for order_id, product_id, category_id, quantity, price in lines:
+        for period in (SalesRollup.HOUR, SalesRollup.DAY):
+            start = period_start(paid_at[order_id], period)
+            deltas[(period, SalesRollup.TOTAL, start, 0)][2] += quantity
+            for dimension, dimension_id in ((SalesRollup.PRODUCT, product_id), (SalesRollup.CATEGORY, category_id)):
+                key = (period, dimension, start, dimension_id)
+                delta = deltas[key]
+                delta[0] += quantity * price
+                delta[2] += quantity
+                # an order counts once per product or category
+                if (key, order_id) not in counted:
+                    counted.add((key, order_id))
+                    delta[1] += 1
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Add the deltas to the roll-up rows: one insert creates the missing rows
+    at zero, then each row is incremented with F() so concurrent batches
+    never overwrite each other. Rows are updated in key order, so two
+    batches lock them in the same order.
+    """
+    SalesRollup.objects.bulk_create([
+        SalesRollup(period=period, dimension=dimension, period_start=start, dimension_id=dimension_id)
+        for period, dimension, start, dimension_id in deltas
+    ], ignore_conflicts=True)
+    for (period, dimension, start, dimension_id), (revenue, orders, units) in sorted(deltas.items()):
+        SalesRollup.objects.filter(
+            period=period, dimension=dimension, period_start=start, dimension_id=dimension_id,
+        ).update(revenue=F('revenue') + revenue, orders=F('orders') + orders, units=F('units') + units)
+
+
+def roll_up_payments(payment_ids=None, batch_size=1000):
+    """
+    Count payments not counted yet into the roll-ups, one transaction per
+    batch: only `payment_ids` when given, else every pending payment.
+    Returns how many payments were rolled up.
+    """
+    rolled_up = 0
+    while True:
+        with transaction.atomic():
+            claimed = claim_payments(payment_ids, batch_size)
+            if claimed is None:
+                return rolled_up
+            batch, taken = claimed
+            if taken:
+                apply_deltas(sales_deltas(batch))
+        rolled_up += taken
+
+
+def roll_up_payment(payment):
+    # live path: a failure only delays the numbers until the catch-up run
+    try:
+        roll_up_payments([payment.pk])
+    except Exception:
+        logger.exception('Could not roll up payment %s, the catch-up run will', payment.pk)
+
+
+def sales_report(since, until, period=SalesRollup.DAY, top=REPORT_TOP):
+    """
+    Revenue, orders and units per period between `since` and `until`, with
+    the totals and the best selling products and categories, read from the
+    roll-ups alone. The bounds snap to the start of their period.
+    """
+    rows = SalesRollup.objects.filter(
+        period=period, period_start__gte=period_start(since, period), period_start__lt=until)
+
+    series = [
+        {'period_start': start, 'revenue': revenue, 'orders': orders, 'units': units}
+        for start, revenue, orders, units in rows.filter(dimension=SalesRollup.TOTAL).order_by('period_start')
+        .values_list('period_start', 'revenue', 'orders', 'units')
+    ]
+
+    def best(dimension, model):
+        ranked = list(rows.filter(dimension=dimension).values('dimension_id')
+                      .annotate(total_units=Sum('units'), total_revenue=Sum('revenue'))
+                      .order_by('-total_units', '-total_revenue', 'dimension_id')[:top])
+        titles = dict(model.objects.filter(pk__in=[row['dimension_id'] for row in ranked]).values_list('id', 'title'))
+        return [
+            {'id': row['dimension_id'], 'title': titles.get(row['dimension_id']),
+             'units': row['total_units'], 'revenue': Decimal(str(row['total_revenue'])).quantize(Decimal('0.01'))}
+            for row in ranked
+        ]
+
+    return {
+        'period': period,
+        'since': period_start(since, period),
+        'until': until,
+        'revenue': sum((row['revenue'] for row in series), Decimal('0.00')),
+        'orders': sum(row['orders'] for row in series),
+        'units': sum(row['units'] for row in series),
+        'series': series,
+        'products': best(SalesRollup.PRODUCT, Product),
+        'categories': best(SalesRollup.CATEGORY, Category),
+    }
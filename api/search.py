@@ -0,0 +1,141 @@
+import re
+from django.db import connection, transaction
+from django.db.models import CharField, Func, IntegerField, Q, Value
+from django.db.models.functions import Cast, Concat
+from rest_framework.filters import BaseFilterBackend
+from .models import Product, ProductSearchDocument
+
+
+SEARCH_RESULT_LIMIT = 1000
+
+# relevance weights for title, description and category title
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+CATEGORY_WEIGHT = 5.0
+
+MYSQL_SEARCH_SQL = """
+    SELECT product_id,
+           MATCH(title) AGAINST (%s IN NATURAL LANGUAGE MODE) * %s
+           + MATCH(title, description, category_title) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+    FROM api_productsearchdocument
+    WHERE MATCH(title, description, category_title) AGAINST (%s IN NATURAL LANGUAGE MODE)
+    ORDER BY score DESC
+    LIMIT %s
+"""
+
+SQLITE_SEARCH_SQL = """
+    SELECT rowid, -bm25(api_productsearchdocument_fts, %s, %s, %s) AS score
+    FROM api_productsearchdocument_fts
+    WHERE api_productsearchdocument_fts MATCH %s
+    ORDER BY score DESC
+    LIMIT %s
+"""
+
+
+def tokenize(term):
+    return re.findall(r'\w+', term.lower())
+
+
+def ranked_product_ids(term, limit=SEARCH_RESULT_LIMIT):
+    """
+    Return [(product_id, score)] for the best matches, highest score first,
+    straight from the full-text index.
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return []
+
+    if connection.vendor == 'mysql':
+        query = ' '.join(tokens)
+        params = [query, TITLE_WEIGHT, query, query, limit]
+        sql = MYSQL_SEARCH_SQL
+    elif connection.vendor == 'sqlite':
+        # quote every token so user input is never parsed as FTS5 syntax
+        query = ' OR '.join(f'"{token}"' for token in tokens)
+        params = [TITLE_WEIGHT, DESCRIPTION_WEIGHT, CATEGORY_WEIGHT, query, limit]
+        sql = SQLITE_SEARCH_SQL
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_products(queryset, term):
+    """
+    Restrict a product queryset to the matches for `term`, most relevant
+    first.
+    """
+    ranked = ranked_product_ids(term)
+
+    if ranked is None:
+        # no full-text index on this backend, fall back to substring matching
+        condition = Q()
+        for token in tokenize(term):
+            condition |= (Q(title__icontains=token) | Q(description__icontains=token) |
+                          Q(category__title__icontains=token))
+        return queryset.filter(condition)
+
+    if not ranked:
+        return queryset.none()
+
+    product_ids = [product_id for product_id, _ in ranked]
+    # order by position in ',3,17,5,' rather than a CASE with one branch per
+    # match, which costs far more to build than the search itself
+    positions = Value(',' + ','.join(str(product_id) for product_id in product_ids) + ',')
+    position = Func(positions, Concat(Value(','), Cast('id', CharField()), Value(',')),
+                    function='INSTR', output_field=IntegerField())
+    return (queryset.filter(pk__in=product_ids)
+            .annotate(search_position=position)
+            .order_by('search_position'))
+
+
+def build_document(product, category_title):
+    return ProductSearchDocument(product_id=product.pk, title=product.title,
+                                 description=product.description, category_title=category_title)
+
+
+def index_product(product):
+    build_document(product, product.category.title).save()
+
+
+def index_products(product_ids=None, batch_size=1000):
+    """
+    Rebuild the search documents for the given products (all when None) in
+    batches, for writes that bypass the post_save signal such as bulk_create.
+    """
+    products = Product.objects.values_list('id', 'title', 'description', 'category__title').order_by('id')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    batch = []
+    for product_id, title, description, category_title in products.iterator(chunk_size=batch_size):
+        batch.append(ProductSearchDocument(product_id=product_id, title=title,
+                                           description=description, category_title=category_title))
+        if len(batch) >= batch_size:
+            _replace_documents(batch)
+            batch = []
+    if batch:
+        _replace_documents(batch)
+
+
+@transaction.atomic
+def _replace_documents(documents):
+    ProductSearchDocument.objects.filter(
+        product_id__in=[document.product_id for document in documents]).delete()
+    ProductSearchDocument.objects.bulk_create(documents)
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Full-text search over product title, description and category title,
+    ranked by relevance, e.g. /api/products/?search=red+shoes
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return search_products(queryset, term)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Category, Product, Review, Cart, CartItems, Order, OrderItem, Payment
+from .models import Category, Product, ProductReviewStats, Review, Cart, CartItems, Order, OrderItem, Payment
+from .pricing import price_cart
 
 
 
@@ -11,11 +12,28 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'featured',
-                  'image', 'rating', 'price', 'category']
+                  'image', 'rating', 'price', 'category',
+                  'review_count', 'rating_avg', 'rating_histogram']
+        read_only_fields = ['review_count', 'rating_avg']
+
+    def get_rating_histogram(self, product: Product):
+        try:
+            return product.review_stats.histogram()
+        except ProductReviewStats.DoesNotExist:
+            return {stars: 0 for stars in range(1, 6)}
+
+    def update(self, instance, validated_data):
+        # write only the fields sent: the review totals and the stock move
+        # with F() updates, a full save would put back the values read here
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
 
 class ProductCreateSerializer(serializers.ModelSerializer):
     category_id = serializers.IntegerField(write_only=True, required=True)
@@ -32,6 +50,14 @@ class ProductCreateSerializer(serializers.ModelSerializer):
 
 
 
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0, required=False)
+    inventory = serializers.IntegerField(min_value=0, required=False)
+    featured = serializers.BooleanField(required=False)
+    discount = serializers.BooleanField(required=False)
+
+
 class SimpleProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -41,7 +67,7 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = '__all__'
+        fields = ['id', 'user', 'product', 'date_created', 'description', 'name', 'rating']
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -54,6 +80,9 @@ class CartItemSerializer(serializers.ModelSerializer):
         ordering = ['id']
 
     def total(self, cartitem: CartItems):
+        # annotated by api/pricing.py when the lines were priced in the query
+        if hasattr(cartitem, 'line_total'):
+            return cartitem.line_total
         return cartitem.quantity * cartitem.product.price
 
 
@@ -92,6 +121,11 @@ class AddCartItemSerializer(serializers.ModelSerializer):
             return self.instance
 
 
+class BulkAddCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     # id = serializers.IntegerField(read_only=True)
     class Meta:
@@ -102,7 +136,7 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
-    items = CartItemSerializer(many=True, read_only=True)
+    items = serializers.SerializerMethodField()
     cart_total = serializers.SerializerMethodField(method_name='main_total')
     total_quantity = serializers.SerializerMethodField(
         method_name='get_total_quantity')
@@ -112,15 +146,22 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ["id", "items", 'cart_total', 'total_quantity']
 
+    def pricing(self, cart: Cart):
+        # the three fields share one query per cart
+        if not hasattr(self, '_pricing'):
+            self._pricing = {}
+        if cart.pk not in self._pricing:
+            self._pricing[cart.pk] = price_cart(cart.pk)
+        return self._pricing[cart.pk]
+
+    def get_items(self, cart: Cart):
+        return CartItemSerializer(self.pricing(cart).lines, many=True, context=self.context).data
+
     def main_total(self, cart: Cart):
-        items = cart.items.all()
-        total = sum([item.quantity * item.product.price for item in items])
-        return total
+        return self.pricing(cart).total
 
     def get_total_quantity(self, cart: Cart):
-        items = cart.items.all()
-        total_quantity = sum([item.quantity for item in items])
-        return total_quantity
+        return self.pricing(cart).quantity
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -132,11 +173,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ('product', 'quantity', 'price', 'order')
 
     def get_order(self, obj):
-        return obj.order.id
+        return obj.order_id
 
 
 class OrderSerializer(serializers.ModelSerializer):
-    products = OrderItemSerializer(many=True, read_only=True, source='product')
+    products = OrderItemSerializer(many=True, read_only=True, source='orderitem_set')
 
     class Meta:
         model = Order
@@ -144,6 +185,17 @@ class OrderSerializer(serializers.ModelSerializer):
                   'shipping_address', 'total_cost')
 
 
+class OrderTransitionSerializer(serializers.Serializer):
+    # paid is only ever set by the Stripe webhook
+    orders = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    status = serializers.ChoiceField(choices=[Order.DELIVERED, Order.CANCELLED])
+
+
+class OrderClaimSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1, max_value=50, default=1)
+    postcode = serializers.CharField(max_length=10, required=False, allow_blank=True)
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
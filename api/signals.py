@@ -3,9 +3,15 @@ from django.core.mail import EmailMessage
 from django.dispatch import receiver
 from djoser.signals import user_registered
 from django.conf import settings
-from django.db.models.signals import Signal, post_save
+from django.db.models.signals import Signal, pre_save, post_save, post_delete
 from urllib.parse import urlunparse
-from .models import Payment
+from .models import Order, Payment, Product, Category, Review, ProductSearchDocument
+from .cache import bump_generation
+from .search import index_product
+from .suggest import update_suggestions
+from .ratings import apply_review_change
+from .history import sync_order_history
+from .facets import FACET_FIELDS, apply_facet_changes, facet_key, product_facet_key
 
 
 html_content_template = Template("""
@@ -52,4 +58,105 @@ def send_welcome_email(sender, request, user, **kwargs):
 
 
 
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    bump_generation('products', f'products:{instance.pk}')
 
+
+@receiver(post_save, sender=Product)
+def update_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def update_suggest_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_suggestions(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    update_suggestions(instance.pk, deleted=True)
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet_key(sender, instance, raw=False, **kwargs):
+    instance._previous_facet_key = None
+    if instance.pk and not raw:
+        previous = Product.objects.filter(pk=instance.pk).values_list(*FACET_FIELDS).first()
+        if previous:
+            instance._previous_facet_key = facet_key(*previous)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_facet_key', None)
+    apply_facet_changes([previous] if previous else [], [product_facet_key(instance)])
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_count(sender, instance, **kwargs):
+    apply_facet_changes([product_facet_key(instance)], [])
+
+
+@receiver(post_save, sender=Category)
+def update_search_category_title(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ProductSearchDocument.objects.filter(
+            product__category=instance).update(category_title=instance.title)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    # every product response nests its category, so this invalidates them too
+    bump_generation('categories', f'categories:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_cache(sender, instance, **kwargs):
+    # product pages carry the review count and average rating
+    product_ids = {instance.product_id}
+    previous = getattr(instance, '_previous_review', None)
+    if previous:
+        product_ids.add(previous[0])
+    names = [f'reviews:{instance.pk}']
+    for product_id in product_ids:
+        names += [f'products:{product_id}', f'reviews:product:{product_id}']
+    bump_generation('products', *names)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_review = None
+    if instance.pk and not raw:
+        instance._previous_review = Review.objects.filter(
+            pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def update_review_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_review', None)
+    if created or previous is None:
+        apply_review_change(instance.product_id, rating=instance.rating, review_delta=1)
+    elif previous[0] != instance.product_id:
+        apply_review_change(previous[0], previous_rating=previous[1], review_delta=-1)
+        apply_review_change(instance.product_id, rating=instance.rating, review_delta=1)
+    elif previous[1] != instance.rating:
+        apply_review_change(instance.product_id, previous_rating=previous[1], rating=instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_stats(sender, instance, **kwargs):
+    apply_review_change(instance.product_id, previous_rating=instance.rating, review_delta=-1)
+
+
+@receiver(post_save, sender=Order)
+def update_order_history(sender, instance, created, raw=False, **kwargs):
+    # new orders get their history at checkout, once their lines exist
+    if not created and not raw:
+        sync_order_history(instance)
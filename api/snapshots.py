@@ -0,0 +1,91 @@
+import gzip
+import os
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import AllowAny
+from rest_framework.test import APIRequestFactory
+from .cache import get_generations
+
+try:
+    import brotli
+except ImportError:  # brotli variants are skipped when the package is missing
+    brotli = None
+
+
+SNAPSHOT_ROOT = getattr(settings, 'SNAPSHOT_ROOT', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+# name: (path rendered, whether the source endpoint requires a logged in user)
+SNAPSHOTS = {
+    'products': ('/api/products/', False),
+    'featured': ('/api/products/?featured=true', False),
+    'categories': ('/api/categories/', True),
+}
+
+# every generation the snapshot payloads depend on
+SNAPSHOT_GENERATIONS = ['products', 'categories', 'catalog', 'facets']
+
+BUILT_GENERATIONS_KEY = 'snapshots:built'
+
+# held while a build renders, expires on its own if the process dies
+BUILD_LOCK_KEY = 'snapshots:building'
+BUILD_LOCK_SECONDS = 60 * 10
+
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+
+def snapshot_path(name, encoding=None):
+    return os.path.join(SNAPSHOT_ROOT, f'{name}.json' + ENCODINGS.get(encoding, ''))
+
+
+def render_snapshot(path):
+    """
+    Render a GET of `path` through its DRF view exactly as a client on the
+    public host would see it.
+    """
+    from . import views
+
+    view_classes = {'/api/products/': views.ProductViewset, '/api/categories/': views.CategoryViewSet}
+    view = view_classes[path.split('?')[0]].as_view(
+        {'get': 'list'}, permission_classes=[AllowAny], authentication_classes=[])
+
+    host = getattr(settings, 'SNAPSHOT_HOST', settings.ALLOWED_HOSTS[0])
+    request = APIRequestFactory().get(path, HTTP_HOST=host, secure=True)
+    response = view(request)
+    response.render()
+    return response.content
+
+
+def write_atomically(path, content):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as target:
+        target.write(content)
+    os.replace(temporary, path)
+
+
+def build_snapshots(force=False):
+    """
+    Render every snapshot with its gzip and brotli variants, unless nothing
+    they depend on has changed since the last build. Catalog writes only
+    bump generations, the build_snapshots cron job picks them up here.
+
+    One build runs at a time, a call while another is rendering returns
+    False and the next run catches whatever changed meanwhile.
+    """
+    generations = get_generations(SNAPSHOT_GENERATIONS)
+    if not force and cache.get(BUILT_GENERATIONS_KEY) == generations:
+        return False
+    if not cache.add(BUILD_LOCK_KEY, 1, timeout=BUILD_LOCK_SECONDS):
+        return False
+
+    try:
+        os.makedirs(SNAPSHOT_ROOT, exist_ok=True)
+        for name, (path, _) in SNAPSHOTS.items():
+            content = render_snapshot(path)
+            write_atomically(snapshot_path(name), content)
+            write_atomically(snapshot_path(name, 'gzip'), gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                write_atomically(snapshot_path(name, 'br'), brotli.compress(content, quality=11))
+        cache.set(BUILT_GENERATIONS_KEY, generations, timeout=None)
+    finally:
+        cache.delete(BUILD_LOCK_KEY)
+    return True
@@ -0,0 +1,293 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .cache import get_generations
+from .models import Category, Product
+from .search import tokenize
+
+
+SUGGEST_LIMIT = 8
+
+# words shorter than this are only ever prefix matched, one typo in a three
+# letter word matches too much to be useful
+MIN_FUZZY_LENGTH = 4
+
+# re-read products changed this long before the last sync as well, to
+# cover clock skew and transactions that committed late
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# a full rebuild now and then picks up ranking changes, e.g. review counts
+SUGGEST_REBUILD_SECONDS = getattr(settings, 'SUGGEST_REBUILD_SECONDS', 60 * 15)
+
+SUGGEST_GENERATIONS = ['products', 'catalog', 'categories']
+
+
+def deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class TitleIndex:
+    """
+    Prefix and one-typo lookups over titles, entirely in memory.
+
+    Every title is split into words. `tokens` is the sorted list of distinct
+    words, so the words starting with a prefix are one bisect away, and
+    `postings` maps each word to its entries ordered best first. Typos are
+    found SymSpell style: `variants` maps every word with one letter removed
+    back to the words it came from.
+
+    Syncs change the structures in place, so searches and changes take
+    `lock`: a search walking a posting list or variant set another thread
+    is editing would fail. Both are short, readers barely wait.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.tokens = []
+        self.postings = {}
+        self.variants = defaultdict(set)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+        Build from (key, title, popularity, payload) rows in one pass,
+        sorting each posting list once instead of inserting row by row.
+        """
+        index = cls()
+        postings = defaultdict(list)
+        for key, title, popularity, payload in rows:
+            rank, tokens = index.describe(key, title, popularity)
+            index.entries[key] = (rank, tokens, payload)
+            for token in tokens:
+                postings[token].append(rank)
+        for token, posting in postings.items():
+            posting.sort()
+            for variant in deletes(token):
+                index.variants[variant].add(token)
+        index.postings = dict(postings)
+        index.tokens = sorted(postings)
+        return index
+
+    @staticmethod
+    def describe(key, title, popularity):
+        # most popular first, then shorter titles, the key keeps ranks unique
+        return (-popularity, len(title), title.lower(), key), set(tokenize(title))
+
+    def add(self, key, title, popularity, payload):
+        rank, tokens = self.describe(key, title, popularity)
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (rank, tokens, payload)
+            for token in tokens:
+                posting = self.postings.get(token)
+                if posting is None:
+                    bisect.insort(self.tokens, token)
+                    for variant in deletes(token):
+                        self.variants[variant].add(token)
+                    self.postings[token] = [rank]
+                else:
+                    bisect.insort(posting, rank)
+
+    def remove(self, key):
+        with self.lock:
+            self.discard(key)
+
+    def discard(self, key):
+        # remove() without the lock, for callers already holding it
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        rank, tokens, _ = entry
+        for token in tokens:
+            posting = self.postings[token]
+            del posting[bisect.bisect_left(posting, rank)]
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+                for variant in deletes(token):
+                    self.variants[variant].discard(token)
+
+    def completions(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\U0010ffff', start)
+        return set(self.tokens[start:end])
+
+    def corrections(self, token):
+        """
+        Known words one insertion, deletion, substitution or swap away.
+        """
+        if len(token) < MIN_FUZZY_LENGTH:
+            return set()
+        found = set(self.variants.get(token, ()))
+        for variant in deletes(token):
+            if variant in self.postings:
+                found.add(variant)
+            found |= self.variants.get(variant, set())
+        found.discard(token)
+        return found
+
+    def match(self, conditions, limit, exclude=()):
+        """
+        Return the payloads of the best entries that contain a word from
+        every condition. Walks the posting lists of the most selective
+        condition in rank order and stops once `limit` entries matched.
+        """
+        def size(words):
+            return sum(len(self.postings.get(word, ())) for word in words)
+
+        driver = min(conditions, key=size)
+        others = [words for words in conditions if words is not driver]
+        found = []
+        seen = set(exclude)
+        for rank in heapq.merge(*(self.postings.get(word, ()) for word in driver)):
+            key = rank[-1]
+            entry = self.entries.get(key)
+            if key in seen or entry is None:
+                continue
+            seen.add(key)
+            if all(entry[1] & words for words in others):
+                found.append(entry[2])
+                if len(found) == limit:
+                    break
+        return found
+
+    def search(self, query, limit=SUGGEST_LIMIT):
+        """
+        Every word but the last has to match a whole word, allowing one
+        typo, and the last one is treated as a prefix still being typed.
+        Typo corrections of the last word only fill the remaining places.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self.lock:
+            return self.locked_search(tokens, limit)
+
+    def locked_search(self, tokens, limit):
+        conditions = []
+        for token in tokens[:-1]:
+            words = {token} if token in self.postings else self.corrections(token)
+            if not words:
+                return []
+            conditions.append(words)
+
+        last = tokens[-1]
+        completions = self.completions(last)
+        results = self.match(conditions + [completions], limit) if completions else []
+        if len(results) < limit:
+            corrections = self.corrections(last) - completions
+            if corrections:
+                exclude = {payload['id'] for payload in results}
+                results += self.match(conditions + [corrections], limit - len(results), exclude)
+        return results
+
+
+class SuggestIndex:
+    """
+    Product and category title indexes, tagged with the catalog generations
+    they were synced at.
+    """
+
+    def __init__(self, generations):
+        self.generations = generations
+        self.built_at = time.monotonic()
+        self.synced_at = timezone.now()
+        self.products = TitleIndex.build(
+            product_row(*row) for row in Product.objects.values_list(*PRODUCT_FIELDS).iterator(chunk_size=5000))
+        self.categories = TitleIndex.build(
+            (category_id, title, 0, {'id': category_id, 'title': title, 'slug': slug})
+            for category_id, title, slug in Category.objects.values_list('id', 'title', 'slug'))
+
+    def expired(self):
+        return time.monotonic() - self.built_at > SUGGEST_REBUILD_SECONDS
+
+    def sync(self, generations):
+        """
+        Apply the products written since the last sync, and drop deleted
+        ones when the product count no longer adds up.
+        """
+        started = timezone.now()
+        changed = Product.objects.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+        for row in changed.values_list(*PRODUCT_FIELDS):
+            self.products.add(*product_row(*row))
+        if len(self.products.entries) != Product.objects.count():
+            existing = set(Product.objects.values_list('id', flat=True))
+            for product_id in set(self.products.entries) - existing:
+                self.products.remove(product_id)
+        self.synced_at = started
+        self.generations = generations
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        return {
+            'products': self.products.search(query, limit),
+            'categories': self.categories.search(query, limit),
+        }
+
+
+PRODUCT_FIELDS = ('id', 'title', 'review_count', 'category__title')
+
+
+def product_row(product_id, title, review_count, category_title):
+    return product_id, title, review_count, {'id': product_id, 'title': title, 'category': category_title}
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def suggest_index():
+    """
+    Return this worker's index, building it on first use and bringing it up
+    to date whenever a catalog generation moved. Category changes rebuild
+    it, since every product entry carries its category title. While one
+    thread refreshes, the others keep answering from the current index.
+    """
+    global _index
+    generations = get_generations(SUGGEST_GENERATIONS)
+    index = _index
+    if index is not None and index.generations == generations and not index.expired():
+        return index
+
+    if not _lock.acquire(blocking=index is None):
+        return index
+    try:
+        index = _index
+        if index is None or index.expired() or index.generations[-1] != generations[-1]:
+            _index = SuggestIndex(generations)
+        elif index.generations != generations:
+            index.sync(generations)
+        return _index
+    finally:
+        _lock.release()
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    return suggest_index().suggest(query, limit)
+
+
+def update_suggestions(product_id, deleted=False):
+    """
+    Apply a product write to this worker's index as soon as it commits,
+    instead of waiting for the next sync.
+    """
+    def apply():
+        index = _index
+        if index is None:
+            return
+        row = None
+        if not deleted:
+            row = Product.objects.filter(pk=product_id).values_list(*PRODUCT_FIELDS).first()
+        with _lock:
+            if row is None:
+                index.products.remove(product_id)
+            else:
+                index.products.add(*product_row(*row))
+
+    transaction.on_commit(apply)
@@ -1,3 +1,214 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.models import CustomUser
+from .inventory import release_stock
+from .models import (Cart, CartItems, Category, InventoryReservation, Order, OrderItem, Payment, Product,
+                     SalesRollup, WebhookEvent)
+from .webhooks import WEBHOOK_MAX_ATTEMPTS, process_events, requeue_dead_events
 
-# Create your tests here.
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# user, lock carts, priced lines, order, order lines, clear cart, order
+# lines read back for the history, history and reservations, plus the
+# savepoint pair the test transaction wraps them in
+CHECKOUT_QUERIES = 11
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='shoes', title='Shoes')
+        cls.products = Product.objects.bulk_create([
+            Product(title=f'Shoe {i}', description='', image='https://example.com/shoe.png',
+                    rating=4, price=10 + i, category=category, inventory=10)
+            for i in range(30)
+        ])
+        cls.user = CustomUser.objects.create_user('buyer@example.com', 'password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, products, quantity=2):
+        CartItems.objects.bulk_create(
+            [CartItems(cart=self.cart, product=product, quantity=quantity) for product in products])
+
+    def checkout(self):
+        return self.client.post('/api/orders/', {'user_id': self.user.id}, format='json')
+
+    def test_checkout_query_budget(self):
+        # constant, plus the one conditional stock update per product
+        self.fill_cart(self.products)
+        with self.assertNumQueries(CHECKOUT_QUERIES + len(self.products)):
+            response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.total_cost, sum(2 * product.price for product in self.products))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), len(self.products))
+        self.assertFalse(CartItems.objects.filter(cart=self.cart).exists())
+        self.assertEqual(set(Product.objects.values_list('inventory', flat=True)), {8})
+
+    def test_order_lines_keep_the_price_at_checkout(self):
+        product = self.products[0]
+        self.fill_cart([product], quantity=3)
+        response = self.checkout()
+        Product.objects.filter(pk=product.pk).update(price=99)
+
+        line = OrderItem.objects.get(order_id=response.data['id'])
+        self.assertEqual((line.quantity, line.price), (3, product.price))
+
+    def test_out_of_stock_writes_nothing(self):
+        self.fill_cart(self.products[:2])
+        Product.objects.filter(pk=self.products[1].pk).update(inventory=1)
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['products'], [self.products[1].pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(InventoryReservation.objects.exists())
+        self.assertEqual(CartItems.objects.filter(cart=self.cart).count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).inventory, 10)
+
+    def test_empty_cart(self):
+        # user, lock carts, priced lines and the savepoint rolled back
+        with self.assertNumQueries(6):
+            response = self.checkout()
+        self.assertEqual(response.data, {'message': 'no items in cart'})
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+@mock.patch('api.webhooks.send_payment_confirmation_email')
+@mock.patch('stripe.checkout.Session.retrieve')
+class WebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='shoes', title='Shoes')
+        cls.product = Product.objects.create(
+            title='Shoe', description='', image='https://example.com/shoe.png',
+            rating=4, price=25, category=category, inventory=10)
+        cls.user = CustomUser.objects.create_user('buyer@example.com', 'password')
+
+    def setUp(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItems.objects.create(cart=cart, product=self.product, quantity=2)
+        response = client.post('/api/orders/', {'user_id': self.user.id}, format='json')
+        self.order = Order.objects.get(pk=response.data['id'])
+
+    def session(self):
+        return SimpleNamespace(
+            id='cs_test', payment_status='paid', metadata={'order_id': str(self.order.pk)},
+            amount_total=5000, created=int(timezone.now().timestamp()),
+            payment_intent=SimpleNamespace(id='pi_test', latest_charge={'receipt_url': 'https://example.com/r'}))
+
+    def post_event(self, event_id, event_type='checkout.session.completed'):
+        event = {'id': event_id, 'type': event_type, 'data': {'object': {'id': 'cs_test'}}}
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            return self.client.post('/webhook/', b'{}', content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=x')
+
+    def confirmed(self):
+        return set(self.order.reservations.values_list('status', flat=True)) == {InventoryReservation.CONFIRMED}
+
+    def test_redelivered_event_is_recorded_once(self, retrieve, send_email):
+        retrieve.return_value = self.session()
+        self.assertEqual(self.post_event('evt_1').status_code, 200)
+        self.assertEqual(self.post_event('evt_1').status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+        self.assertEqual(process_events(), 1)
+        self.assertEqual(process_events(), 0)
+        self.assertEqual(retrieve.call_count, 1)
+
+    def test_one_payment_per_session(self, retrieve, send_email):
+        retrieve.return_value = self.session()
+        self.post_event('evt_1')
+        self.post_event('evt_2', 'checkout.session.async_payment_succeeded')
+        self.assertEqual(process_events(), 2)
+
+        payment = Payment.objects.get()
+        self.assertEqual((payment.session_id, payment.amount_paid, payment.confirmation_due), ('cs_test', 50, False))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.PAID)
+        self.assertTrue(self.confirmed())
+        send_email.assert_called_once()
+        total = SalesRollup.objects.get(period=SalesRollup.DAY, dimension=SalesRollup.TOTAL)
+        self.assertEqual((total.revenue, total.orders, total.units), (50, 1, 2))
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {WebhookEvent.DONE})
+
+    def test_failed_event_is_retried_after_a_backoff(self, retrieve, send_email):
+        retrieve.side_effect = [ConnectionError('stripe is down'), self.session()]
+        self.post_event('evt_1')
+        with self.assertLogs('api.webhooks', 'ERROR'):
+            process_events()
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.PENDING, 1))
+        self.assertIn('stripe is down', event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertFalse(Payment.objects.exists())
+        # not due yet
+        self.assertEqual(process_events(), 0)
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(process_events(), 1)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.last_error), (WebhookEvent.DONE, 2, ''))
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_event_is_dead_after_the_last_attempt(self, retrieve, send_email):
+        retrieve.side_effect = ConnectionError('stripe is down')
+        self.post_event('evt_1')
+        WebhookEvent.objects.update(attempts=WEBHOOK_MAX_ATTEMPTS - 1)
+        with self.assertLogs('api.webhooks', 'ERROR'):
+            process_events()
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.DEAD)
+        self.assertEqual(process_events(), 0)
+
+        self.assertEqual(requeue_dead_events(), 1)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.PENDING, 0))
+
+    def test_email_is_sent_by_the_retry_after_it_failed(self, retrieve, send_email):
+        retrieve.return_value = self.session()
+        send_email.side_effect = [ConnectionError('smtp is down'), None]
+        self.post_event('evt_1')
+        with self.assertLogs('api.webhooks', 'ERROR'):
+            process_events()
+        self.assertTrue(Payment.objects.get().confirmation_due)
+        self.assertTrue(self.confirmed())
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        process_events()
+        self.assertEqual(send_email.call_count, 2)
+        self.assertFalse(Payment.objects.get().confirmation_due)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.DONE)
+        # the retry did not count the payment twice
+        self.assertEqual(SalesRollup.objects.get(period=SalesRollup.DAY, dimension=SalesRollup.TOTAL).orders, 1)
+
+    def test_payment_for_a_cancelled_order_is_flagged_for_a_refund(self, retrieve, send_email):
+        retrieve.return_value = self.session()
+        Order.objects.filter(pk=self.order.pk).update(status=Order.CANCELLED)
+        release_stock([self.order.pk])
+        self.post_event('evt_1')
+        with self.assertLogs('api.webhooks', 'ERROR') as logs:
+            process_events()
+
+        self.assertIn('needs a refund', logs.output[0])
+        self.assertFalse(Payment.objects.get().confirmation_due)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.CANCELLED)
+        self.assertEqual(set(self.order.reservations.values_list('status', flat=True)),
+                         {InventoryReservation.RELEASED})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).inventory, 10)
+        send_email.assert_not_called()
@@ -0,0 +1,56 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from .inventory import release_stock
+from .models import Order, OrderHistory
+
+
+def source_statuses(status):
+    # the statuses an order may be in to move to `status`
+    return [source for source, targets in Order.TRANSITIONS.items() if status in targets]
+
+
+def transition_orders(queryset, order_ids, status):
+    """
+    Move the orders of `queryset` with the given ids to `status`, returning
+    (updated ids, {skipped id: reason}).
+
+    One query reads the current statuses, then one UPDATE per status read
+    moves the orders still in that exact status, so an order changed
+    concurrently is skipped rather than moved from a state nobody checked.
+    Cancelling gives the orders' stock back.
+    """
+    order_ids = set(order_ids)
+    sources = source_statuses(status)
+    current = dict(queryset.filter(pk__in=order_ids).values_list('pk', 'status'))
+
+    skipped = {order_id: 'not found' for order_id in order_ids - set(current)}
+    read = defaultdict(list)
+    for order_id, current_status in current.items():
+        if current_status in sources:
+            read[current_status].append(order_id)
+        else:
+            skipped[order_id] = f'cannot go from {current_status} to {status}'
+    if not read:
+        return [], skipped
+
+    now = timezone.now()
+    moved = []
+    with transaction.atomic():
+        for read_status, candidates in sorted(read.items()):
+            updated = Order.objects.filter(pk__in=candidates, status=read_status).update(
+                status=status, updated_at=now)
+            if updated == len(candidates):
+                moved += candidates
+                continue
+            # some orders changed in between, find out which ones made it
+            made_it = set(Order.objects.filter(pk__in=candidates, status=status, updated_at=now)
+                          .values_list('pk', flat=True))
+            moved += made_it
+            for order_id in set(candidates) - made_it:
+                skipped[order_id] = 'changed by another request'
+        # the update bypasses the signal that keeps the history in sync
+        OrderHistory.objects.filter(order_id__in=moved).update(status=status, updated_at=now)
+        if status == Order.CANCELLED:
+            release_stock(moved)
+    return sorted(moved), skipped
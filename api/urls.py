@@ -30,6 +30,12 @@ urlpatterns = [
     path('', include(cartitem_router.urls)),
     path('orders/', views.OrderView.as_view(), name='order-create'),
     path('orders/<int:pk>/', views.OrderDetailView.as_view(), name='order-detail'),
+    path('orders/transitions/', views.OrderTransitionView.as_view(), name='order-transitions'),
+    path('orders/claim/', views.OrderClaimView.as_view(), name='order-claim'),
+    path('exports/<str:name>.<str:file_format>', views.ExportView.as_view(), name='export'),
+    path('reports/sales/', views.SalesReportView.as_view(), name='sales-report'),
+    path('snapshots/<str:name>/', views.SnapshotView.as_view(), name='catalog-snapshot'),
+    path('metrics/not-modified/', views.ConditionalGetMetricsView.as_view(), name='not-modified-metrics'),
     path('payment/order/<int:pk>/', csrf_exempt(views.PaymentWithStripeView.as_view()), name='checkout-session'),
     path('groups/manager/', views.GroupViewset.as_view({
         'get': 'list', 'post': 'create', 'delete': 'destroy',
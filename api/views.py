@@ -1,5 +1,5 @@
 from django.contrib.auth import authenticate, login, logout, get_user_model
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import Group
 from django.conf import settings
@@ -8,35 +8,57 @@ from django.core.exceptions import ValidationError
 from django.views import View
 from rest_framework.decorators import api_view, action
 from rest_framework.renderers import JSONRenderer
-from rest_framework.pagination import PageNumberPagination
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework import viewsets, status, permissions, generics, views
+from rest_framework import viewsets, status, permissions, generics, views, serializers
 from rest_framework import status
 import requests
 from django.utils.decorators import method_decorator
 from django.middleware.csrf import rotate_token
 from django.contrib.sessions.models import Session
 from django.core.cache import cache
-from django.views.decorators.cache import cache_page
-from .models import Cart, Category, Order, OrderItem, Product, Review, CartItems, Payment
-from .serializers import OrderItemSerializer, OrderSerializer, CategorySerializer, ProductSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, PaymentSerializer, ProductCreateSerializer
+from .models import ArchivedOrder, Cart, Category, Order, OrderHistory, OrderItem, Product, ProductRecommendation, Review, CartItems, Payment, SalesRollup
+from .serializers import OrderItemSerializer, OrderSerializer, OrderClaimSerializer, OrderTransitionSerializer, CategorySerializer, ProductSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, BulkAddCartItemSerializer, UpdateCartItemSerializer, PaymentSerializer, ProductCreateSerializer, ProductBulkUpdateSerializer
 from core.serializers import UserCreateSerializer
 from .permissions import IsReviewOwner
+from .cache import CatalogCacheMixin, conditional_response, not_modified_metric_key
+from .snapshots import SNAPSHOTS, snapshot_path
+from .pagination import OrderHistoryPagination, ProductPagination, ProductCursorPagination, ReviewPagination
+from .search import ProductSearchFilter, search_products
+from .facets import ProductFacetFilter, apply_facet_changes, facet_counts, facet_rows, product_facet_key, selected_facets
+from .cache import bump_generation
+from .bulk import bulk_upsert
+from .recommendations import RECOMMENDATIONS_PER_PRODUCT
+from .suggest import SUGGEST_LIMIT, suggest
+from .pricing import line_total, price_cart_items, price_order
+from .inventory import CHECKOUT_SESSION_SECONDS, OutOfStock, renew_hold
+from .checkout import EmptyCart, place_order
+from .history import ORDER_LINES, order_payload
+from .transitions import transition_orders
+from .dispatch import claim_orders
+from .exports import EXPORT_FORMATS, EXPORTS, export_chunks, parse_bound
+from .rollups import REPORT_TOP, sales_report
+from .idempotency import IdempotencyMixin
+from .webhooks import enqueue_event
+from .carts import add_to_cart, cart_item_payload, cart_payload, cart_store, flush_user_carts, forget_carts, product_summaries, redis_carts_enabled, touch_cart
 from rest_framework_nested import routers
 from django.db.models import Q
+from django.db import transaction
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework.exceptions import APIException, NotFound
+from collections import Counter, defaultdict
+import os
+import uuid
 from core.models import CustomUser
 from . import views
-from datetime import datetime
-from django.utils.timezone import make_aware
+from datetime import timedelta
+from django.utils import timezone
+from django.utils.http import http_date
 import stripe
-from decimal import Decimal
 from django.views.decorators.http import require_POST
-import threading
-from milady.EmailSender import send_payment_confirmation_email
+import time
 
 
 FRONTEND_DOMAIN = 'https://eeki.shop'
@@ -89,6 +111,53 @@ class IndexView(View):
         return JsonResponse({'endpoints': links})
 
 
+class SnapshotView(View):
+    """
+    Serve a prebuilt catalog snapshot straight from disk, picking the
+    brotli or gzip variant the client accepts. No ORM or serializer work.
+    """
+
+    def get(self, request, name):
+        if name not in SNAPSHOTS:
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        _, requires_login = SNAPSHOTS[name]
+        if requires_login:
+            # stateless token check, the user row is never loaded
+            try:
+                authenticated = JWTStatelessUserAuthentication().authenticate(request)
+            except APIException:
+                authenticated = None
+            if authenticated is None:
+                return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                    status=status.HTTP_401_UNAUTHORIZED)
+
+        accepted = request.headers.get('Accept-Encoding', '')
+        for encoding in ('br', 'gzip', None):
+            if encoding is None or encoding in accepted:
+                path = snapshot_path(name, encoding)
+                try:
+                    stat = os.stat(path)
+                    break
+                except FileNotFoundError:
+                    continue
+        else:
+            return JsonResponse({'detail': 'Snapshot not built yet.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+        not_modified = conditional_response(request, 'snapshots', etag=etag)
+        if not_modified is None:
+            with open(path, 'rb') as snapshot:
+                response = HttpResponse(snapshot.read(), content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        else:
+            response = not_modified
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding, Authorization'
+        return response
+
+
 def confirm_email(request, user_id, token):
     try:
         user = get_user_model().objects.get(pk=user_id)
@@ -175,21 +244,32 @@ def logout_view(request):
 
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
+    catalog_namespace = 'categories'
     queryset = Category.objects.all().order_by('id')
     serializer_class = CategorySerializer
 
 
-class ProductPagination(PageNumberPagination):
-    page_size = 8
-
-
-class ProductViewset(viewsets.ModelViewSet):
-    queryset = Product.objects.order_by('id')
-    ordering_fields = ['category', 'price']
-    search_fields = ['title', 'category__title']
+class ProductViewset(CatalogCacheMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.select_related('category', 'review_stats').order_by('id')
+    catalog_namespace = 'products'
+    # 'catalog' is bumped by bulk writers that skip the per-product signals
+    catalog_dependencies = ('categories', 'catalog')
+    ordering_fields = ['id', 'price', 'rating', 'rating_avg', 'review_count']
+    filter_backends = [ProductSearchFilter, ProductFacetFilter]
+    bulk_update_max_rows = 10000
     pagination_class = ProductPagination
 
+    @property
+    def paginator(self):
+        # ?pagination=cursor switches to keyset pages, which skip COUNT(*) and OFFSET
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_serializer_class(self):
         if self.action == 'create':
             return ProductCreateSerializer
@@ -203,13 +283,128 @@ class ProductViewset(viewsets.ModelViewSet):
 
         return [permission() for permission in permission_classes]
 
-    @method_decorator(cache_page(60 * 30))  # Cache the response for 30 minutes
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        The filtered product page together with the product count for every
+        facet value, read from the precomputed facet counts.
+        """
+        return self.cached_response(request, lambda: self.facet_page(request))
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Typeahead matches for ?q= on product and category titles, served
+        from this worker's in-memory index, e.g. ?q=red dre&limit=5
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', SUGGEST_LIMIT)), 20))
+        except ValueError:
+            return Response({'detail': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest(request.query_params.get('q', ''), limit))
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """
+        Products most often bought together with this one, best match first,
+        read from the table written by build_recommendations.
+        """
+        try:
+            product_id = int(pk)
+            limit = max(1, min(int(request.query_params.get('limit', 8)), RECOMMENDATIONS_PER_PRODUCT))
+        except ValueError:
+            return Response({'detail': 'Invalid product id or limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        recommendations = list(
+            ProductRecommendation.objects.filter(product_id=product_id)
+            .select_related('related_product__category', 'related_product__review_stats')
+            .order_by('-score')[:limit])
+        if not recommendations and not Product.objects.filter(pk=product_id).exists():
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = ProductSerializer(
+            [recommendation.related_product for recommendation in recommendations],
+            many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='bulk-update')
+    def bulk_update(self, request):
+        """
+        Update price, inventory, featured and discount for many products at
+        once, e.g. [{"id": 1, "price": "9.99", "inventory": 40}, ...].
+        Valid rows are applied in a single transaction, invalid ones are
+        reported back by their index in the payload.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a list of products'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > self.bulk_update_max_rows:
+            return Response({'detail': f'At most {self.bulk_update_max_rows} products per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        errors = []
+        changes = {}
+        # one serializer validates every row, building it per row costs more than the write
+        validator = ProductBulkUpdateSerializer()
+        for index, row in enumerate(rows):
+            try:
+                data = validator.run_validation(row)
+            except serializers.ValidationError as e:
+                errors.append({'index': index, 'errors': e.detail})
+                continue
+            if data['id'] in changes:
+                errors.append({'index': index, 'errors': {'id': ['Duplicate product in this request.']}})
+            else:
+                changes[data['id']] = (index, data)
+
+        # the rows are read locked, so the facet keys and the unsent fields
+        # are not overwritten with values a concurrent write already changed
+        groups = defaultdict(list)
+        with transaction.atomic():
+            products = {product.pk: product for product in
+                        Product.objects.select_for_update().filter(pk__in=list(changes)).order_by('pk')}
+            previous_keys, new_keys = [], []
+            for product_id, (index, data) in changes.items():
+                product = products.get(product_id)
+                if product is None:
+                    errors.append({'index': index, 'errors': {'id': ['Product does not exist.']}})
+                    continue
+                previous_keys.append(product_facet_key(product))
+                sent = tuple(sorted(field for field in data if field != 'id'))
+                for field in sent:
+                    setattr(product, field, data[field])
+                new_keys.append(product_facet_key(product))
+                if sent:
+                    groups[sent].append(product)
+
+            # each row writes only the fields it sent, one upsert per field set
+            for sent, group in groups.items():
+                bulk_upsert(Product, group, list(sent) + ['updated_at'])
+            if groups:
+                apply_facet_changes(previous_keys, new_keys)
+        updated = sum(len(group) for group in groups.values())
+        if updated:
+            bump_generation('products', 'catalog')
+
+        errors.sort(key=lambda error: error['index'])
+        response_status = status.HTTP_200_OK if products or not errors else status.HTTP_400_BAD_REQUEST
+        return Response({'updated': updated, 'errors': errors}, status=response_status)
+
+    def facet_page(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        # the precomputed counts cover the whole catalog, a search is counted
+        # over its matches instead
+        term = request.query_params.get(ProductSearchFilter.search_param, '').strip()
+        rows = facet_rows(search_products(Product.objects.all(), term)) if term else None
+        response.data['facets'] = facet_counts(selected_facets(request), rows)
+        return response
 
     def finalize_response(self, request, response, *args, **kwargs):
         # Optionally, modify response data before finalizing the response
-        if settings.MY_PROTOCOL == "https":
+        if settings.MY_PROTOCOL == "https" and isinstance(getattr(response, 'data', None), dict):
             if response.data.get("next"):
                 response.data["next"] = response.data["next"].replace("http://", "https://")
 
@@ -220,19 +415,34 @@ class ProductViewset(viewsets.ModelViewSet):
 
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all()
+class ReviewViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
+    catalog_namespace = 'reviews'
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
+    # newest first by default, ?ordering=date_created for oldest first
+    ordering_fields = ['date_created']
+
+    def get_queryset(self):
+        return self.product_reviews_queryset(self.kwargs['product_pk'])
+
+    def product_reviews_queryset(self, product_id):
+        # served by the (product, date_created, id) index, without joins
+        return Review.objects.filter(product_id=product_id).only(*ReviewSerializer.Meta.fields)
+
+    def get_catalog_generations(self):
+        # a review only invalidates the pages of its own product
+        if 'pk' in self.kwargs:
+            return [f'reviews:{self.kwargs["pk"]}']
+        return [f'reviews:product:{self.kwargs["product_pk"]}']
 
     @action(detail=True, methods=['get'])
-    def product_reviews(self, request, pk=None):
+    def product_reviews(self, request, product_pk=None, pk=None):
         """
-        Get all reviews for a specific product.
+        Get the reviews for the product `pk`, paginated like the list.
         """
-        product = Product.objects.get(pk=pk)
-        reviews = product.reviews.all()
-        serializer = self.get_serializer(reviews, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(self.product_reviews_queryset(pk))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def get_permissions(self):
         """
@@ -267,6 +477,8 @@ class CartViewSet(viewsets.ModelViewSet):
             if cart.completed:
                 cart.completed = False
                 cart.save()
+            if redis_carts_enabled():
+                return Response(cart_payload(cart.pk, cart_store().items(cart.pk)), status=status.HTTP_200_OK)
             serializer = self.get_serializer(cart)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -279,17 +491,36 @@ class CartViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def retrieve(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        cart_id = kwargs['pk']
+        items = cart_store().items(cart_id) if valid_uuid(cart_id) else None
+        if items is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(cart_payload(cart_id, items))
 
-class CartItemViewSet(viewsets.ModelViewSet):
+
+def valid_uuid(value):
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+class CartItemViewSet(IdempotencyMixin, viewsets.ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
+    bulk_add_max_lines = 500
 
     def get_queryset(self):
         cart_id = self.kwargs.get("cart_pk")
         if cart_id is None:
             return CartItems.objects.none()
-        return CartItems.objects.filter(cart_id=cart_id).order_by('id')
+        return (CartItems.objects.filter(cart_id=cart_id).select_related('product')
+                .annotate(line_total=line_total('product__price')).order_by('id'))
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -318,16 +549,116 @@ class CartItemViewSet(viewsets.ModelViewSet):
             )
         data = serializer.validated_data
         product_id = data.get("product_id")
-        product = get_object_or_404(Product, pk=product_id)
         quantity = data.get("quantity", 1)
-        cart_item = CartItems.objects.filter(
-            cart=cart, product=product).first()
-        if cart_item:
-            cart_item.quantity += quantity
-            cart_item.save()
+        items, missing = add_to_cart(cart.pk, {product_id: quantity})
+        if missing:
+            raise NotFound('No Product matches the given query.')
+        serializer.instance = items[product_id]
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk=None):
+        """
+        Add many products in one request, e.g. [{"product_id": 1, "quantity": 2}, ...].
+        Quantities add to the lines already in the cart. Either every line is
+        applied or, if a product does not exist, none is.
+        """
+        serializer = BulkAddCartItemSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > self.bulk_add_max_lines:
+            return Response({'detail': f'At most {self.bulk_add_max_lines} lines per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        lines = Counter()
+        for line in serializer.validated_data:
+            lines[line['product_id']] += line['quantity']
+
+        if not valid_uuid(cart_pk):
+            return Response({'error': 'Invalid cart_id'}, status=status.HTTP_400_BAD_REQUEST)
+        if redis_carts_enabled():
+            if not cart_store().exists(cart_pk):
+                return Response({'error': 'Invalid cart_id'}, status=status.HTTP_400_BAD_REQUEST)
+            missing = sorted(set(lines) - set(product_summaries(lines)))
+            quantities = {} if missing else cart_store().add_many(cart_pk, dict(lines))
         else:
-            cart_item = serializer.save(
-                cart=cart, product=product, quantity=quantity)
+            if not Cart.objects.filter(pk=cart_pk).exists():
+                return Response({'error': 'Invalid cart_id'}, status=status.HTTP_400_BAD_REQUEST)
+            items, missing = add_to_cart(cart_pk, dict(lines))
+            quantities = {product_id: item.quantity for product_id, item in items.items()}
+
+        if missing:
+            return Response({'product_id': missing, 'detail': 'These products do not exist'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'items': [{'product_id': product_id, 'quantity': quantity}
+                                   for product_id, quantity in sorted(quantities.items())]})
+
+    # with CART_STORE = 'redis' the actions below read and write the live cart
+    # in Redis, and the item id in the URL is the product id
+
+    def live_cart(self):
+        cart_id = self.kwargs.get('cart_pk')
+        if not valid_uuid(cart_id):
+            return cart_id, None
+        return cart_id, cart_store().items(cart_id)
+
+    def list(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().list(request, *args, **kwargs)
+        cart_id, items = self.live_cart()
+        if items is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        lines = cart_payload(cart_id, items)['items']
+        return Response({'count': len(lines), 'next': None, 'previous': None, 'results': lines})
+
+    def retrieve(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        cart_id, items = self.live_cart()
+        product_id = int(kwargs['pk']) if kwargs['pk'].isdigit() else None
+        summary = product_summaries([product_id]).get(product_id) if items and product_id in items else None
+        if summary is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(cart_item_payload(cart_id, product_id, items[product_id], summary))
+
+    def create(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart_id = self.kwargs.get('cart_pk')
+        if not valid_uuid(cart_id) or not cart_store().exists(cart_id):
+            return Response({'error': 'Invalid cart_id'}, status=status.HTTP_400_BAD_REQUEST)
+        product_id = serializer.validated_data['product_id']
+        if product_id not in product_summaries([product_id]):
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        quantity = cart_store().add(cart_id, product_id, serializer.validated_data.get('quantity', 1))
+        return Response({'id': product_id, 'product_id': product_id, 'quantity': quantity},
+                        status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().partial_update(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart_id, items = self.live_cart()
+        product_id = int(kwargs['pk']) if kwargs['pk'].isdigit() else None
+        if not items or product_id not in items:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        quantity = serializer.validated_data.get('quantity', items[product_id])
+        cart_store().set(cart_id, product_id, quantity)
+        return Response({'quantity': quantity})
+
+    def destroy(self, request, *args, **kwargs):
+        if not redis_carts_enabled():
+            return super().destroy(request, *args, **kwargs)
+        cart_id, items = self.live_cart()
+        product_id = int(kwargs['pk']) if kwargs['pk'].isdigit() else None
+        if not items or product_id not in items:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        cart_store().remove_one(cart_id, product_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        touch_cart(serializer.instance.cart_id)
 
     def perform_destroy(self, instance):
         if instance.quantity > 1:
@@ -335,10 +666,13 @@ class CartItemViewSet(viewsets.ModelViewSet):
             instance.save()
         else:
             instance.delete()
+        touch_cart(instance.cart_id)
 
     def delete(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        queryset.delete()
+        deleted, _ = queryset.delete()
+        if deleted:
+            touch_cart(self.kwargs['cart_pk'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -358,9 +692,11 @@ class OrderItemViewSet(viewsets.ModelViewSet):
 
 
 
-class OrderView(generics.ListCreateAPIView):
+class OrderView(IdempotencyMixin, generics.ListCreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderHistoryPagination
+    ordering_fields = ['date_created']
 
     def get_queryset(self):
         if self.request.user.is_superuser:
@@ -368,29 +704,40 @@ class OrderView(generics.ListCreateAPIView):
         elif self.request.user.groups.count() == 0:
             return Order.objects.filter(cart__user=self.request.user)
         elif self.request.user.groups.filter(name='Delivery Crew').exists():
-            return Order.objects.filter(status=Order.PENDING, cart__items__product__seller=self.request.user)
+            return Order.objects.filter(delivery_crew=self.request.user).prefetch_related(ORDER_LINES)
         else:
             return Order.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        # customers and managers page through the order history, one
+        # indexed query per page with no joins and no per-order queries
+        user = request.user
+        if user.is_superuser:
+            histories = OrderHistory.objects.all()
+        else:
+            groups = set(user.groups.values_list('name', flat=True))
+            if 'Delivery Crew' in groups:
+                return super().list(request, *args, **kwargs)
+            histories = OrderHistory.objects.all() if groups else OrderHistory.objects.filter(user=user)
+
+        page = self.paginate_queryset(histories)
+        return self.get_paginated_response([order_payload(history) for history in page])
+
     def create(self, request, *args, **kwargs):
         user_id = request.data.get('user_id', None)
         user = get_object_or_404(CustomUser, id=user_id)
         if user_id is None:
             return Response({'message': 'user_id is required to create an order'}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_items = CartItems.objects.filter(cart__user_id=user_id)
-        if not cart_items.exists():
+        flushed = flush_user_carts(user_id)
+        try:
+            order = place_order(user)
+        except EmptyCart:
             return Response({'message': 'no items in cart'})
-
-        order = Order(cart=cart_items.first().cart,
-                      total_cost=self.get_total_price(cart_items), user=user)
-        order.save()
-
-        for cart_item in cart_items:
-            OrderItem.objects.create(order=order, product=cart_item.product,
-                                     quantity=cart_item.quantity, price=cart_item.product.price)
-
-        cart_items.delete()
+        except OutOfStock as e:
+            return Response({'message': 'not enough stock', 'products': e.product_ids},
+                            status=status.HTTP_409_CONFLICT)
+        forget_carts(flushed)
 
         serialized_order = OrderSerializer(order)
         return Response(serialized_order.data)
@@ -403,7 +750,7 @@ class OrderView(generics.ListCreateAPIView):
         return Response(serialized_order.data)
 
     def get_total_price(self, cart_items):
-        return sum([cart_item.quantity * cart_item.product.price for cart_item in cart_items])
+        return price_cart_items(cart_items).total
 
 
 
@@ -413,18 +760,160 @@ class OrderDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        order = self.get_object()
+        found = self.find_order(kwargs['pk'])
+        if found is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        user_id, payload, updated_at = found
 
         # check if the user who made the request is the owner of the order or an admin user
-        if request.user == order.cart.user or request.user.is_staff:
-            serializer = self.serializer_class(order)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        if request.user.id == user_id or request.user.is_staff:
+            # updated_at moves on every change to the order, so it validates the
+            # client's copy before any serializer work
+            etag = f'"order-{kwargs["pk"]}-{updated_at.timestamp():.6f}"'
+            not_modified = conditional_response(
+                request, 'orders', etag=etag, last_modified=int(updated_at.timestamp()))
+            if not_modified is not None:
+                return not_modified
+
+            response = Response(payload, status=status.HTTP_200_OK)
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(updated_at.timestamp())
+            return response
         else:
             return Response({'detail': 'You do not have permission to access this order.'}, status=status.HTTP_403_FORBIDDEN)
 
+    def find_order(self, pk):
+        """
+        Return (user id, payload, updated_at) of the order, from its history
+        row, or from the archive once the order left the hot tables.
+        """
+        history = OrderHistory.objects.filter(order_id=pk).first()
+        if history is not None:
+            return history.user_id, order_payload(history), history.updated_at
+        # orders placed before the history existed are rendered from the
+        # order itself until rebuild_order_history writes their row
+        order = Order.objects.filter(pk=pk).prefetch_related(ORDER_LINES).first()
+        if order is not None:
+            return order.user_id, OrderSerializer(order).data, order.updated_at
+        archived = ArchivedOrder.objects.filter(pk=pk).first()
+        if archived is None:
+            return None
+        return archived.user_id, archived.document, archived.updated_at
+
+
+
+class OrderTransitionView(APIView):
+    """
+    Move many orders to a new status in one request. Managers can move any
+    order, the delivery crew can only mark their own orders delivered.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data['status']
+
+        user = request.user
+        groups = set(user.groups.values_list('name', flat=True))
+        if user.is_superuser or 'Manager' in groups:
+            orders = Order.objects.all()
+        elif 'Delivery Crew' in groups and new_status == Order.DELIVERED:
+            orders = Order.objects.filter(delivery_crew=user)
+        else:
+            return Response({'detail': 'You do not have permission to change these orders.'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        updated, skipped = transition_orders(orders, serializer.validated_data['orders'], new_status)
+        return Response({
+            'status': new_status,
+            'updated': updated,
+            'skipped': [{'id': order_id, 'reason': reason} for order_id, reason in sorted(skipped.items())],
+        })
+
+
+
+class OrderClaimView(APIView):
+    """
+    The delivery crew's work queue: claim the next paid, unassigned orders,
+    oldest first, optionally within a postcode area.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.groups.filter(name='Delivery Crew').exists():
+            return Response({'detail': 'Only the delivery crew can claim orders.'}, status=status.HTTP_403_FORBIDDEN)
+        serializer = OrderClaimSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        claimed = claim_orders(request.user, serializer.validated_data['count'],
+                               serializer.validated_data.get('postcode'))
+        histories = OrderHistory.objects.filter(order_id__in=claimed).order_by('date_created', 'id')
+        return Response({'claimed': [order_payload(history) for history in histories]})
+
+
+
+class ExportView(APIView):
+    """
+    Stream orders, order items or payments as CSV or JSONL, a batch at a
+    time, optionally limited to ?since= and ?until= dates.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name, file_format):
+        export = EXPORTS.get(name)
+        if export is None or file_format not in EXPORT_FORMATS:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            since = parse_bound(request.query_params.get('since'))
+            until = parse_bound(request.query_params.get('until'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(export_chunks(export, file_format, since, until),
+                                         content_type=EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{name}.{file_format}"'
+        return response
+
+
+
+class SalesReportView(APIView):
+    """
+    Sales between ?since= and ?until= (the last 30 days by default), per
+    ?period=day or hour, answered from the roll-ups.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        period = request.query_params.get('period', SalesRollup.DAY)
+        if period not in dict(SalesRollup.PERIOD_CHOICES):
+            return Response({'detail': 'period must be day or hour'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            until = parse_bound(request.query_params.get('until')) or timezone.now()
+            since = parse_bound(request.query_params.get('since')) or until - timedelta(days=30)
+            top = max(1, min(int(request.query_params.get('top', REPORT_TOP)), 100))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if since >= until:
+            return Response({'detail': 'since must be before until'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(sales_report(since, until, period, top))
+
+
+
+class ConditionalGetMetricsView(APIView):
+    """
+    Number of 304 Not Modified responses served per resource.
+    """
+    permission_classes = [IsAdminUser]
+    resources = ['products', 'categories', 'reviews', 'orders', 'snapshots']
+
+    def get(self, request):
+        counts = cache.get_many([not_modified_metric_key(name) for name in self.resources])
+        return Response({name: counts.get(not_modified_metric_key(name), 0) for name in self.resources})
+
 
 
-class PaymentWithStripeView(APIView):
+class PaymentWithStripeView(IdempotencyMixin, APIView):
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -443,15 +932,21 @@ class PaymentWithStripeView(APIView):
         # Update the shipping_address
         order.shipping_address = shipping_address
         order.save()
-        # Fetch order items associated with the order
-        order_items = OrderItem.objects.filter(order=order)
-
         # Check if the order has already been paid for
         if Payment.objects.filter(Q(order=order) & Q(user=request.user)).exists():
             return JsonResponse({'error': 'Order has already been paid for.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Calculate the total cost based on order items
-        total_cost = sum([item.quantity * item.price for item in order_items])
+        # hold the stock for longer than the checkout session can stay open
+        try:
+            renew_hold(order)
+        except OutOfStock as e:
+            return JsonResponse({'error': 'Some items are no longer in stock.', 'products': e.product_ids},
+                                status=status.HTTP_409_CONFLICT)
+
+        # Fetch the order items with their products and the total in one query
+        pricing = price_order(order)
+        order_items = pricing.lines
+        total_cost = pricing.total
 
         # Extract product names and images from order items
         product_names = [item.product.title for item in order_items]
@@ -481,6 +976,7 @@ class PaymentWithStripeView(APIView):
                 line_items=line_items,
                 metadata={'order_id': order.id},
                 mode='payment',
+                expires_at=int(time.time()) + CHECKOUT_SESSION_SECONDS,
                 success_url=FRONTEND_DOMAIN + '/payment/confirm/' + '?success=true',
                 cancel_url=FRONTEND_DOMAIN + '/payment/cancel/' + '?canceled=true',
             )
@@ -508,47 +1004,11 @@ def stripe_webhook_view(request):
     except stripe.error.SignatureVerificationError as e:
         return HttpResponse(status=400)
 
-    # Acknowledge receipt immediately
-    HttpResponse("ok", status=200)
-
-    # Start a new thread to process the event asynchronously
-    event_data = event['data']['object']
-    threading.Thread(target=process_checkout, args=(event_data,)).start()
-
+    # record the event and acknowledge it, a process_webhooks worker does the rest
+    enqueue_event(event)
     return HttpResponse("ok", status=200)
 
 
-def process_checkout(event_data):
-    session = stripe.checkout.Session.retrieve(
-        event_data['id'],
-        expand=['customer', 'payment_intent.latest_charge']
-    )
-
-    if session and session.payment_status == 'paid':
-        order_id = session.metadata.get('order_id')
-        order = Order.objects.get(id=order_id)
-        order.status = 'paid'
-        order.save()
-
-        amount_total_in_pounds = Decimal(session.amount_total) / 100
-        receipt_url = session.payment_intent.latest_charge.get('receipt_url')
-
-        payment_date = make_aware(datetime.utcfromtimestamp(session.created))
-        payment = Payment(
-            user=order.user,
-            order=order,
-            paymentintent_id=session.payment_intent.id,
-            session_id=session.id,
-            amount_paid=amount_total_in_pounds,
-            payment_date=payment_date,
-            receipt_url=receipt_url,
-        )
-        payment.save()
-
-        send_payment_confirmation_email(order, receipt_url)
-
-
-
 class GroupViewset(viewsets.ViewSet):
     permission_classes = [IsAdminUser]
     # throttle_classes = [AnonRateThrottle, UserRateThrottle]
@@ -0,0 +1,213 @@
+import logging
+import random
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import stripe
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from milady.EmailSender import send_payment_confirmation_email
+from .inventory import confirm_stock
+from .models import Order, Payment, WebhookEvent
+from .rollups import roll_up_payment
+
+
+logger = logging.getLogger(__name__)
+
+# 'redis' also pushes a wake-up to a Redis list for every event, so idle
+# workers block on it instead of polling; the events stay in the database
+WEBHOOK_QUEUE = getattr(settings, 'WEBHOOK_QUEUE', 'database')
+
+WEBHOOK_MAX_ATTEMPTS = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+
+# retries wait 30s, 1m, 2m, ... up to 6h, with jitter
+WEBHOOK_RETRY_SECONDS = getattr(settings, 'WEBHOOK_RETRY_SECONDS', 30)
+WEBHOOK_MAX_RETRY_SECONDS = getattr(settings, 'WEBHOOK_MAX_RETRY_SECONDS', 6 * 60 * 60)
+
+# how long a worker holds an event before another may take it over
+WEBHOOK_LEASE_SECONDS = getattr(settings, 'WEBHOOK_LEASE_SECONDS', 5 * 60)
+
+WAKEUP_KEY = 'webhooks:wakeup'
+
+
+def redis_queue_enabled():
+    return WEBHOOK_QUEUE == 'redis'
+
+
+def redis_connection():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def process_checkout(session_data):
+    """
+    Record the payment of a paid Checkout Session and mark its order paid.
+
+    The payment is unique per session, so an event delivered or retried
+    twice finds it: the order and the stock are only touched the first
+    time. The stock is only confirmed for an order this payment moved from
+    pending to paid, a payment for an order that was cancelled in the
+    meantime is logged for a refund. The confirmation email is sent until
+    an attempt gets it out, so a retry sends it if the last one failed.
+    """
+    session = stripe.checkout.Session.retrieve(
+        session_data['id'],
+        expand=['customer', 'payment_intent.latest_charge']
+    )
+    if not session or session.payment_status != 'paid':
+        return
+
+    receipt_url = session.payment_intent.latest_charge.get('receipt_url')
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(id=session.metadata.get('order_id'))
+        payment, created = Payment.objects.get_or_create(session_id=session.id, defaults={
+            'user': order.user,
+            'order': order,
+            'paymentintent_id': session.payment_intent.id,
+            'amount_paid': Decimal(session.amount_total) / 100,
+            'payment_date': datetime.fromtimestamp(session.created, dt_timezone.utc),
+            'receipt_url': receipt_url,
+            'confirmation_due': order.status == Order.PENDING,
+        })
+        if created and payment.confirmation_due:
+            order.status = Order.PAID
+            order.save()
+            confirm_stock(order)
+        elif created:
+            logger.error('Payment %s came in for order %s, which is %s, it needs a refund',
+                         payment.pk, order.pk, order.status)
+
+    # both pick up where an earlier attempt stopped
+    roll_up_payment(payment)
+    if payment.confirmation_due:
+        send_payment_confirmation_email(order, payment.receipt_url)
+        Payment.objects.filter(pk=payment.pk).update(confirmation_due=False)
+
+
+# what each event type runs with the event's data object, other types are
+# recorded and marked done
+HANDLERS = {
+    'checkout.session.completed': process_checkout,
+    'checkout.session.async_payment_succeeded': process_checkout,
+}
+
+
+def enqueue_event(event):
+    """
+    Record a verified Stripe event for the workers: one INSERT, which
+    does nothing for an event id already recorded.
+    """
+    WebhookEvent.objects.bulk_create([WebhookEvent(
+        event_id=event['id'], event_type=event['type'], payload=event['data']['object'],
+    )], ignore_conflicts=True)
+    if redis_queue_enabled():
+        try:
+            redis = redis_connection()
+            redis.lpush(WAKEUP_KEY, event['id'])
+            redis.ltrim(WAKEUP_KEY, 0, 999)
+        except Exception:
+            # the workers still poll, the event only waits a little longer
+            logger.exception('Could not wake the webhook workers for %s', event['id'])
+
+
+def due_events(now):
+    # pending events whose time has come, and events a worker took but
+    # never finished
+    return WebhookEvent.objects.filter(
+        Q(status=WebhookEvent.PENDING, next_attempt_at__lte=now)
+        | Q(status=WebhookEvent.PROCESSING, locked_until__lt=now))
+
+
+def claim_events(batch_size=10):
+    """
+    Take up to `batch_size` due events for this worker, oldest first, and
+    return them.
+
+    Candidates are locked with SKIP LOCKED where the database has it, so
+    concurrent workers pick disjoint events. Either way the UPDATE only
+    takes events still due, so two workers never both hold one.
+    """
+    now = timezone.now()
+    claim = uuid.uuid4()
+    with transaction.atomic():
+        candidates = due_events(now).order_by('next_attempt_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        candidates = list(candidates.values_list('pk', flat=True)[:batch_size])
+        if not candidates:
+            return []
+        due_events(now).filter(pk__in=candidates).update(
+            status=WebhookEvent.PROCESSING, claim=claim, attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=WEBHOOK_LEASE_SECONDS), updated_at=now)
+    return list(WebhookEvent.objects.filter(claim=claim).order_by('next_attempt_at', 'pk'))
+
+
+def retry_delay(attempts):
+    delay = min(WEBHOOK_RETRY_SECONDS * 2 ** (attempts - 1), WEBHOOK_MAX_RETRY_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.75, 1.0))
+
+
+def run_event(event):
+    """
+    Handle a claimed event and record the outcome: done, pending again
+    after a backoff, or dead once it has failed WEBHOOK_MAX_ATTEMPTS
+    times. Returns the new status.
+    """
+    handler = HANDLERS.get(event.event_type)
+    try:
+        if handler is not None:
+            handler(event.payload)
+    except Exception:
+        logger.exception('Webhook event %s failed on attempt %s', event.event_id, event.attempts)
+        now = timezone.now()
+        if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            outcome = {'status': WebhookEvent.DEAD}
+        else:
+            outcome = {'status': WebhookEvent.PENDING, 'next_attempt_at': now + retry_delay(event.attempts)}
+        outcome['last_error'] = traceback.format_exc()
+    else:
+        now = timezone.now()
+        outcome = {'status': WebhookEvent.DONE, 'last_error': ''}
+
+    # an event whose lease ran out may have been taken over, the new holder
+    # records its own outcome
+    WebhookEvent.objects.filter(pk=event.pk, claim=event.claim).update(
+        claim=None, locked_until=None, updated_at=now, **outcome)
+    return outcome['status']
+
+
+def process_events(batch_size=10):
+    """
+    Claim and handle one batch of due events, returning how many there were.
+    """
+    events = claim_events(batch_size)
+    for event in events:
+        run_event(event)
+    return len(events)
+
+
+def wait_for_events(stop, timeout):
+    """
+    Idle until there may be new events, `timeout` seconds at most or until
+    `stop` is set: blocking on the Redis wake-ups when they are on, else
+    polling.
+    """
+    if redis_queue_enabled():
+        try:
+            redis_connection().blpop(WAKEUP_KEY, timeout=max(int(timeout), 1))
+            return
+        except Exception:
+            logger.exception('Could not wait on the webhook wake-ups')
+    stop.wait(timeout)
+
+
+def requeue_dead_events():
+    """
+    Give dead events a fresh set of attempts, once whatever broke them is
+    fixed. Returns how many were requeued.
+    """
+    return WebhookEvent.objects.filter(status=WebhookEvent.DEAD).update(
+        status=WebhookEvent.PENDING, attempts=0, next_attempt_at=timezone.now(), updated_at=timezone.now())
@@ -2,4 +2,9 @@ bind = "0.0.0.0:8000"
 workers = 2
 threads = 4
 worker_class = "sync"
-timeout = 120
\ No newline at end of file
+timeout = 120
+
+def post_worker_init(worker):
+    # build the typeahead index before the worker takes its first request
+    from api.suggest import suggest_index
+    suggest_index()
@@ -62,8 +62,6 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -209,8 +207,21 @@ DJOSER = {
     },
 }
 
-CACHE_MIDDLEWARE_ALIAS = 'default'
-CACHE_MIDDLEWARE_SECONDS = 60 * 30  # 30 minutes
+# Catalog responses are invalidated by generation bumps in api/signals.py,
+# so the TTL only bounds how long unused entries stay in Redis
+CATALOG_CACHE_SECONDS = 60 * 60 * 24  # 24 hours
+
+# Prebuilt landing page responses, see api/snapshots.py
+SNAPSHOT_ROOT = os.path.join(BASE_DIR, 'snapshots')
+SNAPSHOT_HOST = 'milady-store.shop'
+
+# Co-occurrence counts kept between build_recommendations runs
+RECOMMENDATIONS_STATE = os.path.join(BASE_DIR, 'recommendations.npz')
+
+# Old orders and dead carts moved out of the hot tables, see api/archive.py
+ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+ORDER_ARCHIVE_DAYS = 365
+CART_ARCHIVE_DAYS = 180
 
 # CACHES = {
 #     'default': {
@@ -232,8 +243,22 @@ CACHES = {
 
 
 
+# 'redis' keeps live carts in Redis hashes and writes them back to
+# Cart/CartItems every minute and at checkout, see api/carts.py
+CART_STORE = os.getenv('CART_STORE', 'database')
+
+# Stripe webhooks are queued in WebhookEvent for process_webhooks workers;
+# 'redis' also wakes idle workers through Redis, see api/webhooks.py
+WEBHOOK_QUEUE = os.getenv('WEBHOOK_QUEUE', 'database')
+
 CRONJOBS = [
     ('0 2 * * *', 'milady.management.commands.remove_expired_tokens'),
+    ('* * * * *', 'django.core.management.call_command', ['flush_carts']),
+    ('* * * * *', 'django.core.management.call_command', ['release_expired_reservations']),
+    ('* * * * *', 'django.core.management.call_command', ['build_snapshots']),
+    ('30 2 * * *', 'django.core.management.call_command', ['build_recommendations']),
+    ('*/10 * * * *', 'django.core.management.call_command', ['roll_up_sales']),
+    ('0 4 * * *', 'django.core.management.call_command', ['archive_orders']),
 ]
 
 cloudinary.config(